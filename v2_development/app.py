@@ -22,6 +22,16 @@ import time
 import os
 import sqlite3
 import uuid
+import zlib
+import dataclasses
+import random
+import heapq
+import itertools
+import math
+import asyncio
+import functools
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 from functools import wraps
 
 # Descope authentication
@@ -33,6 +43,12 @@ except ImportError:
     print("Warning: Descope not installed. Run: pip install descope")
     descope_client = None
 
+# NumPy is optional: multi-city combinations are scored by broadcasting when it is installed
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 logging.basicConfig(level=logging.WARNING)
 
 # Initialize SQLite database for job tracking
@@ -219,6 +235,1544 @@ def require_auth(f):
     
     return decorated_function
 
+# Upstream query cache settings (shared by every search job in this process)
+FLIGHT_CACHE_TTL_SECONDS = int(os.environ.get('FLIGHT_CACHE_TTL_SECONDS', 600))
+FLIGHT_CACHE_MAX_ENTRIES = int(os.environ.get('FLIGHT_CACHE_MAX_ENTRIES', 2000))
+# Empty results (no service that day, beyond the schedule) expire sooner
+FLIGHT_CACHE_NEGATIVE_TTL_SECONDS = int(os.environ.get('FLIGHT_CACHE_NEGATIVE_TTL_SECONDS', 300))
+# Interactive searches may be served expired entries this long past expiry while they refresh
+FLIGHT_CACHE_STALE_SECONDS = int(os.environ.get('FLIGHT_CACHE_STALE_SECONDS', 900))
+# TTL by days until departure, as "max_days:ttl_seconds" bands; dates past every band use FLIGHT_CACHE_TTL_SECONDS
+FLIGHT_CACHE_TTL_BANDS = os.environ.get('FLIGHT_CACHE_TTL_BANDS', '3:300,14:900,60:3600,inf:21600')
+
+def parse_ttl_bands(spec):
+    """Parse "max_days:ttl_seconds,..." into a sorted list of (max_days, ttl_seconds)"""
+    bands = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            max_days, ttl = part.split(':')
+            bands.append((float(max_days), int(ttl)))
+        except ValueError:
+            print(f"Ignoring invalid cache TTL band: {part}")
+    return sorted(bands)
+
+class FlightQueryCache:
+    """Thread-safe LRU cache of upstream flight query results with a TTL.
+
+    Negative entries (queries that returned no flights) are kept for their
+    own, usually shorter, TTL and counted separately. Positive entries get
+    a TTL from ttl_bands by days until departure, since near-term fares move
+    much faster than far-future ones. Expired entries are retained for
+    stale_seconds so stale-while-revalidate lookups can still serve them
+    while a refresh runs.
+    """
+
+    def __init__(self, ttl_seconds=600, max_entries=2000, negative_ttl_seconds=300, stale_seconds=0,
+                 ttl_bands=None):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.ttl_bands = ttl_bands or []
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, expires_at, negative, stored_at, ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        entry = self.get_with_age(key)
+        return entry[0] if entry is not None else None
+
+    def get_with_age(self, key, allow_stale=False):
+        """Return (value, age_seconds, is_stale) for key, or None.
+
+        With allow_stale, an expired entry still inside the stale window is
+        returned and flagged instead of counting as a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, negative, stored_at, _ = entry
+            is_stale = expires_at <= now
+            if is_stale:
+                if now - expires_at >= self.stale_seconds:
+                    del self._entries[key]
+                    self.expirations += 1
+                    self.misses += 1
+                    return None
+                if not allow_stale:
+                    self.misses += 1
+                    return None
+                self.stale_hits += 1
+
+            # Mark as most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if negative:
+                self.negative_hits += 1
+            return value, now - stored_at, is_stale
+
+    def peek(self, key):
+        """Cached value for key, even if stale, without counting a lookup or touching LRU order"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None else None
+
+    def remaining_ttl(self, key):
+        """Seconds until key expires (negative once stale), or None if not cached; not counted as a lookup"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] - time.time() if entry is not None else None
+
+    def ttl_for(self, departure_date=None, negative=False):
+        """TTL for a result whose earliest flight leaves on departure_date (YYYY-MM-DD)"""
+        if negative:
+            return self.negative_ttl_seconds
+        if not departure_date or not self.ttl_bands:
+            return self.ttl_seconds
+        try:
+            days = (datetime.strptime(departure_date, '%Y-%m-%d').date() - datetime.now().date()).days
+        except ValueError:
+            return self.ttl_seconds
+        for max_days, ttl in self.ttl_bands:
+            if days <= max_days:
+                return ttl
+        return self.ttl_seconds
+
+    def set(self, key, value, ttl=None, negative=False):
+        """Store value under key, evicting least recently used entries if full"""
+        if self.max_entries <= 0:
+            return
+
+        if ttl is None:
+            ttl = self.ttl_for(negative=negative)
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            now = time.time()
+            self._entries[key] = (value, now + ttl, negative, now, ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            ttl_distribution = {}
+            for entry in self._entries.values():
+                ttl_key = str(int(entry[4]))
+                ttl_distribution[ttl_key] = ttl_distribution.get(ttl_key, 0) + 1
+            return {
+                'entries': len(self._entries),
+                'negative_entries': sum(1 for entry in self._entries.values() if entry[2]),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'negative_ttl_seconds': self.negative_ttl_seconds,
+                'stale_seconds': self.stale_seconds,
+                'ttl_bands': [{'max_days': f'{max_days:g}', 'ttl_seconds': ttl} for max_days, ttl in self.ttl_bands],
+                'ttl_distribution': ttl_distribution,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups > 0 else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+class DiskQueryCache:
+    """SQLite-backed cache of compressed query results shared by worker processes.
+
+    Survives restarts, so new workers start warm. WAL mode lets several
+    processes read while one writes; every operation opens its own
+    connection, like the jobs database helpers.
+
+    Writes keep a running estimate of the store size instead of summing it;
+    expired and least recently used rows are swept only once the estimate
+    goes over budget, or every SWEEP_EVERY writes to pick up other
+    processes' writes.
+    """
+
+    SWEEP_EVERY = 256
+
+    def __init__(self, path, max_bytes=200 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._writes_since_sweep = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.evictions = 0
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+
+    def _init_db(self):
+        try:
+            conn = self._connect()
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS query_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    payload BLOB,
+                    size INTEGER,
+                    expires_at REAL,
+                    last_access REAL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_query_cache_access ON query_cache (last_access)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_query_cache_expires ON query_cache (expires_at)')
+            conn.commit()
+            self._bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM query_cache').fetchone()[0]
+            conn.close()
+        except Exception as e:
+            print(f"Error initializing query cache database: {e}")
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        """Return (payload dict, expires_at) for a fresh entry, or None"""
+        try:
+            now = time.time()
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute('SELECT payload, expires_at FROM query_cache WHERE cache_key = ?', (key,))
+            row = c.fetchone()
+            if row is None or row[1] <= now:
+                conn.close()
+                self._count('misses')
+                return None
+
+            c.execute('UPDATE query_cache SET last_access = ? WHERE cache_key = ?', (now, key))
+            conn.commit()
+            conn.close()
+            self._count('hits')
+            return json.loads(zlib.decompress(row[0]).decode('utf-8')), row[1]
+        except Exception as e:
+            print(f"Error reading query cache: {e}")
+            self._count('errors')
+            return None
+
+    def fresh_keys(self, keys):
+        """Subset of keys with a fresh entry; not counted as lookups"""
+        fresh = set()
+        try:
+            now = time.time()
+            conn = self._connect()
+            c = conn.cursor()
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                c.execute(
+                    f'SELECT cache_key FROM query_cache WHERE expires_at > ? AND cache_key IN ({",".join("?" * len(chunk))})',
+                    [now] + chunk
+                )
+                fresh.update(row[0] for row in c.fetchall())
+            conn.close()
+        except Exception as e:
+            print(f"Error reading query cache: {e}")
+            self._count('errors')
+        return fresh
+
+    def set(self, key, payload, ttl):
+        """Store a JSON-serializable payload, sweeping expired and least recently used rows when due"""
+        if ttl <= 0:
+            return
+        try:
+            now = time.time()
+            blob = zlib.compress(json.dumps(payload).encode('utf-8'))
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute('SELECT size FROM query_cache WHERE cache_key = ?', (key,))
+            replaced = c.fetchone()
+            c.execute('''
+                INSERT OR REPLACE INTO query_cache (cache_key, payload, size, expires_at, last_access)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (key, blob, len(blob), now + ttl, now))
+
+            with self._lock:
+                self._bytes += len(blob) - (replaced[0] if replaced else 0)
+                self._writes_since_sweep += 1
+                sweep = self._bytes > self.max_bytes or self._writes_since_sweep >= self.SWEEP_EVERY
+                if sweep:
+                    self._writes_since_sweep = 0
+            if sweep:
+                self._sweep(c, now)
+
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"Error writing query cache: {e}")
+            self._count('errors')
+
+    def _sweep(self, c, now):
+        """Delete expired rows, then least recently used ones until the store fits, and resync the size"""
+        c.execute('DELETE FROM query_cache WHERE expires_at <= ?', (now,))
+
+        c.execute('SELECT COALESCE(SUM(size), 0) FROM query_cache')
+        total_bytes = c.fetchone()[0]
+        excess = total_bytes - self.max_bytes
+        victims = []
+        if excess > 0:
+            # Drop least recently used rows until the store fits again
+            for victim_key, size in c.execute('SELECT cache_key, size FROM query_cache ORDER BY last_access'):
+                if excess <= 0:
+                    break
+                victims.append((victim_key,))
+                excess -= size
+                total_bytes -= size
+            c.executemany('DELETE FROM query_cache WHERE cache_key = ?', victims)
+
+        with self._lock:
+            self._bytes = total_bytes
+            self.evictions += len(victims)
+
+    def stats(self):
+        entries, total_bytes = 0, 0
+        try:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM query_cache')
+            entries, total_bytes = c.fetchone()
+            conn.close()
+        except Exception as e:
+            print(f"Error reading query cache stats: {e}")
+        with self._lock:
+            return {
+                'path': self.path,
+                'entries': entries,
+                'bytes': total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'errors': self.errors
+            }
+
+class BackgroundRefresher:
+    """Runs stale cache refreshes off the request path, one per key at a time"""
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cache-refresh')
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.scheduled = 0
+        self.failed = 0
+
+    def schedule(self, key, refresh):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            self.scheduled += 1
+        self._executor.submit(self._run, key, refresh)
+
+    def _run(self, key, refresh):
+        try:
+            refresh()
+        except Exception as e:
+            print(f"Error refreshing cached query: {e}")
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'scheduled': self.scheduled,
+                'failed': self.failed
+            }
+
+class InFlightQueries:
+    """Registry that lets concurrent identical upstream queries share one call"""
+
+    def __init__(self):
+        self._pending = {}  # key -> Future of the leader's call
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def run(self, key, fetch):
+        """Call fetch() unless an identical query is already running, then wait on it"""
+        with self._lock:
+            future = self._pending.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._pending[key] = future
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._pending),
+                'upstream_calls': self.leaders,
+                'coalesced': self.coalesced
+            }
+
+def is_rate_limit_error(error):
+    """True if an upstream error looks like Google throttling us (HTTP 429)"""
+    message = str(error)
+    return message.startswith('429') or 'Too Many Requests' in message
+
+def is_no_flights_error(error):
+    """True if fast_flights reported an empty result rather than a failure"""
+    return isinstance(error, RuntimeError) and str(error).startswith('No flights found')
+
+class AdaptiveRateLimiter:
+    """Token bucket for upstream calls that adapts to upstream health.
+
+    A rate-limit response halves the rate and a high error ratio over the
+    recent window cuts it by a quarter (never below min_rate). Successful
+    calls raise it additively back toward the configured maximum.
+    """
+
+    def __init__(self, rate, burst, min_rate, window=20, error_threshold=0.3):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.error_threshold = error_threshold
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._outcomes = deque(maxlen=window)  # True = error
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.rate_limited = 0
+        self.slowdowns = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a token is available"""
+        waited = False
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    if waited:
+                        self.waits += 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            waited = True
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """Take a token if one is available right now, without waiting"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def _slow_down(self, factor):
+        self.rate = max(self.min_rate, self.rate * factor)
+        self._outcomes.clear()
+        self.slowdowns += 1
+
+    def record_success(self):
+        with self._lock:
+            self._outcomes.append(False)
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def record_failure(self, error):
+        with self._lock:
+            if is_rate_limit_error(error):
+                self.rate_limited += 1
+                self._slow_down(0.5)
+                return
+
+            self._outcomes.append(True)
+            if len(self._outcomes) >= 5:
+                error_ratio = sum(self._outcomes) / len(self._outcomes)
+                if error_ratio >= self.error_threshold:
+                    self._slow_down(0.75)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rate_per_second': round(self.rate, 2),
+                'max_rate_per_second': self.max_rate,
+                'burst': self.burst,
+                'waits': self.waits,
+                'rate_limited': self.rate_limited,
+                'slowdowns': self.slowdowns
+            }
+
+# Upstream throttle: steady rate, burst size and the floor it backs off to
+UPSTREAM_RATE_PER_SECOND = float(os.environ.get('UPSTREAM_RATE_PER_SECOND', 5))
+UPSTREAM_BURST = int(os.environ.get('UPSTREAM_BURST', 10))
+UPSTREAM_MIN_RATE_PER_SECOND = float(os.environ.get('UPSTREAM_MIN_RATE_PER_SECOND', 0.5))
+
+class CircuitBreakerOpen(Exception):
+    """Raised instead of calling the upstream while the circuit breaker is open"""
+
+class UpstreamPoolBusy(Exception):
+    """Raised when no upstream worker frees up in time; says nothing about upstream health"""
+
+class JobBudgetExceeded(Exception):
+    """Raised when a search job has used up its upstream call budget or deadline"""
+
+    def __init__(self, reason, job_ctx=None):
+        super().__init__(f"Search budget exhausted ({reason})")
+        self.reason = reason
+        self.job_ctx = job_ctx
+
+class CircuitBreaker:
+    """Fails fast across all jobs once upstream calls keep failing.
+
+    After failure_threshold consecutive failures the breaker opens. Once
+    reset_seconds have passed a single probe call is let through; its
+    outcome closes the breaker again or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=60):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.trips = 0
+
+    def before_call(self):
+        """Raise CircuitBreakerOpen unless a call may go ahead"""
+        with self._lock:
+            if self.state == 'closed':
+                return
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                return
+            self.rejected += 1
+            retry_in = max(0, self.reset_seconds - (time.monotonic() - self._opened_at))
+            raise CircuitBreakerOpen(f"Upstream unavailable, retrying in {retry_in:.0f}s")
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+
+    def release_probe(self):
+        """Give back a half-open probe that never reached the upstream; the breaker re-opens"""
+        with self._lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self._failures,
+                'trips': self.trips,
+                'rejected_calls': self.rejected
+            }
+
+class LatencyTracker:
+    """Rolling window of recent successful upstream call latencies"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples=1):
+        """Latency at the given percentile, or None with too few samples"""
+        with self._lock:
+            if len(self._samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def stats(self):
+        with self._lock:
+            samples = len(self._samples)
+        return {
+            'samples': samples,
+            'p50_seconds': self.percentile(50),
+            'p90_seconds': self.percentile(90),
+            'p99_seconds': self.percentile(99)
+        }
+
+class UpstreamPolicy:
+    """Timeout, retry, hedging and circuit-breaker settings for every upstream call"""
+
+    def __init__(self, timeout_seconds=30, max_retries=2, backoff_base_seconds=1.0,
+                 backoff_max_seconds=10.0, breaker=None, max_workers=64,
+                 hedging=False, hedge_percentile=90, hedge_max_extra_load=0.1,
+                 hedge_min_samples=20, rate_limiter=None):
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_max_extra_load = hedge_max_extra_load
+        self.hedge_min_samples = hedge_min_samples
+        self.rate_limiter = rate_limiter
+        self.latency = LatencyTracker()
+        # Calls run on this pool so the caller can stop waiting after the timeout;
+        # a hung request keeps its worker until the socket gives up, so the pool
+        # should be larger than the number of concurrent callers.
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upstream')
+        self._lock = threading.Lock()
+        self.timeouts = 0
+        self.pool_busy = 0
+        self.attempts = 0
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+
+    def _timed_call(self, fn, args, kwargs, running=None):
+        if running is not None:
+            running.set()
+        started = time.monotonic()
+        result = fn(*args, **kwargs)
+        return result, time.monotonic() - started
+
+    def _hedge_delay(self):
+        """How long to wait for the primary request before hedging, or None"""
+        if not self.hedging:
+            return None
+        return self.latency.percentile(self.hedge_percentile, min_samples=self.hedge_min_samples)
+
+    def _claim_hedge(self, hedge_budget=None):
+        """Reserve a duplicate request within the extra-load budget and the caller's own budget"""
+        with self._lock:
+            if self.hedges_sent + 1 > self.hedge_max_extra_load * self.attempts:
+                return False
+            if self.rate_limiter is not None and not self.rate_limiter.try_acquire():
+                return False
+            if hedge_budget is not None and not hedge_budget():
+                return False
+            self.hedges_sent += 1
+            return True
+
+    def execute(self, fn, *args, hedge_budget=None, **kwargs):
+        """Run one upstream attempt, bounded by the timeout.
+
+        With hedging on, a duplicate request is sent if the first one has
+        not answered by the observed latency percentile, and whichever
+        succeeds first wins. hedge_budget() is called to charge the
+        duplicate to the caller; it is skipped when that returns False.
+        """
+        timeout = self.timeout_seconds if self.timeout_seconds and self.timeout_seconds > 0 else None
+        running = threading.Event()
+        primary = self._executor.submit(self._timed_call, fn, args, kwargs, running)
+
+        # The timeout covers the request itself, not the wait for a free worker.
+        # If the pool stays full of hung calls, give up without blaming the upstream.
+        if not running.wait(timeout) and primary.cancel():
+            with self._lock:
+                self.pool_busy += 1
+            raise UpstreamPoolBusy(f"No upstream worker free after {self.timeout_seconds}s")
+        started = time.monotonic()
+        with self._lock:
+            self.attempts += 1
+        pending = {primary}
+
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None and (timeout is None or hedge_delay < timeout):
+            done, _ = wait(pending, timeout=hedge_delay)
+            if not done and self._claim_hedge(hedge_budget):
+                pending.add(self._executor.submit(self._timed_call, fn, args, kwargs))
+
+        first_error = None
+        while pending:
+            remaining = None if timeout is None else timeout - (time.monotonic() - started)
+            if remaining is not None and remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+
+            for future in done:
+                try:
+                    result, elapsed = future.result()
+                except Exception as e:
+                    first_error = first_error or e
+                    continue
+
+                self.latency.record(elapsed)
+                if future is not primary:
+                    with self._lock:
+                        self.hedge_wins += 1
+                for other in pending:
+                    other.cancel()
+                return result
+
+        if not pending and first_error is not None:
+            raise first_error
+
+        for future in pending:
+            future.cancel()
+        with self._lock:
+            self.timeouts += 1
+        raise TimeoutError(f"Upstream query timed out after {self.timeout_seconds}s")
+
+    def backoff_delay(self, attempt):
+        """Exponential backoff with jitter for the given (1-based) failed attempt"""
+        delay = min(self.backoff_max_seconds, self.backoff_base_seconds * (2 ** (attempt - 1)))
+        return random.uniform(delay / 2, delay)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'timeout_seconds': self.timeout_seconds,
+                'max_retries': self.max_retries,
+                'attempts': self.attempts,
+                'timeouts': self.timeouts,
+                'pool_busy': self.pool_busy,
+                'hedging': self.hedging,
+                'hedges_sent': self.hedges_sent,
+                'hedge_wins': self.hedge_wins,
+                'latency': self.latency.stats(),
+                'circuit_breaker': self.breaker.stats()
+            }
+
+# Upstream timeout / retry / circuit-breaker policy
+UPSTREAM_TIMEOUT_SECONDS = float(os.environ.get('UPSTREAM_TIMEOUT_SECONDS', 30))
+UPSTREAM_MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', 2))
+UPSTREAM_BACKOFF_BASE_SECONDS = float(os.environ.get('UPSTREAM_BACKOFF_BASE_SECONDS', 1))
+UPSTREAM_BACKOFF_MAX_SECONDS = float(os.environ.get('UPSTREAM_BACKOFF_MAX_SECONDS', 10))
+CIRCUIT_BREAKER_THRESHOLD = int(os.environ.get('CIRCUIT_BREAKER_THRESHOLD', 5))
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.environ.get('CIRCUIT_BREAKER_RESET_SECONDS', 60))
+# Optional hedging: duplicate slow requests after the p90 latency, within an extra-load budget
+UPSTREAM_HEDGING = os.environ.get('UPSTREAM_HEDGING', '0').lower() in ('1', 'true', 'yes')
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 90))
+HEDGE_MAX_EXTRA_LOAD = float(os.environ.get('HEDGE_MAX_EXTRA_LOAD', 0.1))
+
+# Persistent query cache next to jobs.db (set FLIGHT_DISK_CACHE_PATH='' to disable)
+FLIGHT_DISK_CACHE_PATH = os.environ.get('FLIGHT_DISK_CACHE_PATH', 'query_cache.db')
+FLIGHT_DISK_CACHE_MAX_MB = int(os.environ.get('FLIGHT_DISK_CACHE_MAX_MB', 200))
+
+# Adaptive date sampling (date_sampling=adaptive): coarse departure step, share of the
+# exhaustive 1-day grid it may sample, and how many cheap regions each refine round explores
+ADAPTIVE_COARSE_STEP_DAYS = int(os.environ.get('ADAPTIVE_COARSE_STEP_DAYS', 8))
+ADAPTIVE_SAMPLE_FRACTION = float(os.environ.get('ADAPTIVE_SAMPLE_FRACTION', 0.25))
+ADAPTIVE_REFINE_REGIONS = int(os.environ.get('ADAPTIVE_REFINE_REGIONS', 3))
+# One-way decomposition (date_sampling=one-way): round trips verified with real round-trip queries
+ONE_WAY_VERIFY_TOP = int(os.environ.get('ONE_WAY_VERIFY_TOP', 20))
+
+# Range and multi-city combinations are searched likely-cheapest first ('price') or in date order ('calendar')
+COMBINATION_ORDER = os.environ.get('COMBINATION_ORDER', 'price')
+
+# Range and multi-city jobs keep only their cheapest results (0 = keep everything)
+RESULTS_TOP_K = int(os.environ.get('RESULTS_TOP_K', 500))
+
+# Multi-city legs are combined from their cheapest N flights each
+MULTI_CITY_BEAM_WIDTH = int(os.environ.get('MULTI_CITY_BEAM_WIDTH', 20))
+# Largest number of leg combinations scored at once with NumPy; bigger ones use the k-best queue
+VECTORIZED_COMBINE_MAX_CELLS = int(os.environ.get('VECTORIZED_COMBINE_MAX_CELLS', 250000))
+
+# Date range searches run serially unless more workers are configured
+RANGE_SEARCH_WORKERS = int(os.environ.get('RANGE_SEARCH_WORKERS', 1))
+MAX_RANGE_SEARCH_WORKERS = int(os.environ.get('MAX_RANGE_SEARCH_WORKERS', 8))
+
+# Background warming of the most-searched queries (off by default)
+CACHE_WARMING = os.environ.get('CACHE_WARMING', '0').lower() in ('1', 'true', 'yes')
+CACHE_WARM_INTERVAL_SECONDS = int(os.environ.get('CACHE_WARM_INTERVAL_SECONDS', 300))
+CACHE_WARM_BUDGET = int(os.environ.get('CACHE_WARM_BUDGET', 30))  # upstream calls per cycle
+CACHE_WARM_TOP_SEARCHES = int(os.environ.get('CACHE_WARM_TOP_SEARCHES', 20))
+CACHE_WARM_LOOKBACK_DAYS = int(os.environ.get('CACHE_WARM_LOOKBACK_DAYS', 7))
+
+# Search cost estimates (/estimate): latency assumed before any upstream call was timed,
+# and the ETA above which the estimate warns and suggests a cheaper search
+ESTIMATE_DEFAULT_LATENCY_SECONDS = float(os.environ.get('ESTIMATE_DEFAULT_LATENCY_SECONDS', 3))
+ESTIMATE_WARN_SECONDS = float(os.environ.get('ESTIMATE_WARN_SECONDS', 120))
+
+# Search jobs run on a fixed pool of workers; beyond JOB_QUEUE_SIZE waiting jobs, searches get a 503
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 8))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 50))
+
+# Search engine backend: 'threads' (default) or 'asyncio'
+SEARCH_ENGINE_BACKEND = os.environ.get('SEARCH_ENGINE_BACKEND', 'threads')
+ASYNC_MAX_IN_FLIGHT = int(os.environ.get('ASYNC_MAX_IN_FLIGHT', 200))
+# Concurrent jobs on the asyncio backend; they hold no thread, so this can exceed JOB_WORKERS
+ASYNC_JOB_WORKERS = int(os.environ.get('ASYNC_JOB_WORKERS', 50))
+# Queries one async job keeps in flight; by default every running job's share fits the
+# in-flight pool, so queued queries wait in the tier-ordered FetchScheduler, not a FIFO
+ASYNC_JOB_MAX_IN_FLIGHT = int(os.environ.get('ASYNC_JOB_MAX_IN_FLIGHT', 0)) or \
+    max(1, ASYNC_MAX_IN_FLIGHT // ASYNC_JOB_WORKERS)
+
+# Upstream call pool: above the most concurrent callers (every job fanning out at once,
+# or the async in-flight cap, plus warming/refresh), doubled when hedging may add a duplicate
+UPSTREAM_MAX_WORKERS = int(os.environ.get('UPSTREAM_MAX_WORKERS', 0)) or \
+    (max(JOB_WORKERS * MAX_RANGE_SEARCH_WORKERS, ASYNC_MAX_IN_FLIGHT) + 16) * (2 if UPSTREAM_HEDGING else 1)
+
+flight_query_cache = FlightQueryCache(
+    ttl_seconds=FLIGHT_CACHE_TTL_SECONDS,
+    max_entries=FLIGHT_CACHE_MAX_ENTRIES,
+    negative_ttl_seconds=FLIGHT_CACHE_NEGATIVE_TTL_SECONDS,
+    stale_seconds=FLIGHT_CACHE_STALE_SECONDS,
+    ttl_bands=parse_ttl_bands(FLIGHT_CACHE_TTL_BANDS)
+)
+disk_query_cache = DiskQueryCache(
+    FLIGHT_DISK_CACHE_PATH,
+    max_bytes=FLIGHT_DISK_CACHE_MAX_MB * 1024 * 1024
+) if FLIGHT_DISK_CACHE_PATH else None
+in_flight_queries = InFlightQueries()
+stale_refresher = BackgroundRefresher()
+upstream_rate_limiter = AdaptiveRateLimiter(
+    rate=UPSTREAM_RATE_PER_SECOND,
+    burst=UPSTREAM_BURST,
+    min_rate=UPSTREAM_MIN_RATE_PER_SECOND
+)
+upstream_policy = UpstreamPolicy(
+    timeout_seconds=UPSTREAM_TIMEOUT_SECONDS,
+    max_retries=UPSTREAM_MAX_RETRIES,
+    backoff_base_seconds=UPSTREAM_BACKOFF_BASE_SECONDS,
+    backoff_max_seconds=UPSTREAM_BACKOFF_MAX_SECONDS,
+    breaker=CircuitBreaker(
+        failure_threshold=CIRCUIT_BREAKER_THRESHOLD,
+        reset_seconds=CIRCUIT_BREAKER_RESET_SECONDS
+    ),
+    hedging=UPSTREAM_HEDGING,
+    hedge_percentile=HEDGE_PERCENTILE,
+    hedge_max_extra_load=HEDGE_MAX_EXTRA_LOAD,
+    rate_limiter=upstream_rate_limiter,
+    max_workers=UPSTREAM_MAX_WORKERS
+)
+
+class FetchScheduler:
+    """Weighted fair ordering of upstream rate-limiter tokens across user tiers.
+
+    Callers queue per tier. Each time a token can be handed out, the waiting
+    tier with the lowest virtual time goes next and its virtual time advances
+    by 1/weight, so tiers share the upstream rate in proportion to their
+    weights. Every tier has a positive weight, so free-tier work keeps moving
+    even while paying tiers saturate the upstream.
+    """
+
+    def __init__(self, weights, rate_limiter, default_tier='free'):
+        self.weights = weights
+        self.rate_limiter = rate_limiter
+        self.default_tier = default_tier
+        self._cond = threading.Condition()
+        self._queues = {}  # tier -> deque of waiting tickets
+        self._virtual_times = {}  # tier -> virtual time of its next grant
+        self._virtual_time = 0.0
+        self._granting = False
+        self._job_tiers = {}  # job_id -> tier
+        self.granted = {}
+        self.wait_seconds = {}
+
+    def assign_job(self, job_id, tier):
+        if job_id is not None:
+            with self._cond:
+                self._job_tiers[job_id] = tier
+
+    def release_job(self, job_id):
+        with self._cond:
+            self._job_tiers.pop(job_id, None)
+
+    def tier_for_job(self, job_id):
+        with self._cond:
+            return self._job_tiers.get(job_id, self.default_tier)
+
+    def _next_tier(self):
+        waiting = [tier for tier, queue in self._queues.items() if queue]
+        return min(waiting, key=lambda tier: (self._virtual_times[tier], -self.weights[tier]))
+
+    def acquire(self, tier=None):
+        """Wait for this tier's turn, then take a rate-limiter token"""
+        if tier not in self.weights:
+            tier = self.default_tier
+        ticket = object()
+        started = time.time()
+        with self._cond:
+            queue = self._queues.setdefault(tier, deque())
+            if not queue:
+                # An idle tier rejoins at the current virtual time instead of banking credit
+                self._virtual_times[tier] = max(self._virtual_times.get(tier, 0.0), self._virtual_time)
+            queue.append(ticket)
+            while self._granting or queue[0] is not ticket or self._next_tier() != tier:
+                self._cond.wait()
+            self._granting = True
+
+        try:
+            self.rate_limiter.acquire()
+        finally:
+            with self._cond:
+                queue.popleft()
+                self._virtual_time = self._virtual_times[tier]
+                self._virtual_times[tier] += 1.0 / self.weights[tier]
+                self._granting = False
+                self.granted[tier] = self.granted.get(tier, 0) + 1
+                self.wait_seconds[tier] = self.wait_seconds.get(tier, 0.0) + time.time() - started
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                tier: {
+                    'weight': weight,
+                    'waiting': len(self._queues.get(tier, ())),
+                    'granted': self.granted.get(tier, 0),
+                    'avg_wait_seconds': round(self.wait_seconds.get(tier, 0.0) / self.granted[tier], 3)
+                    if self.granted.get(tier) else 0
+                }
+                for tier, weight in self.weights.items()
+            }
+
+def parse_tier_settings(spec, cast=float):
+    """Parse "tier:value,..." into a dict"""
+    settings = {}
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            tier, value = part.split(':')
+            settings[tier.strip()] = cast(value)
+        except ValueError:
+            print(f"Ignoring invalid tier setting: {part}")
+    return settings
+
+def parse_tier_weights(spec):
+    """Parse "tier:weight,..." into a dict; weights are kept positive so no tier starves"""
+    weights = {tier: max(weight, 0.01) for tier, weight in parse_tier_settings(spec).items()}
+    weights.setdefault('free', 1.0)
+    return weights
+
+# Share of upstream capacity per user tier; 'background' covers cache warming and stale refreshes
+UPSTREAM_TIER_WEIGHTS = os.environ.get(
+    'UPSTREAM_TIER_WEIGHTS', 'free:1,pro:3,premium:6,unlimited:6,admin:6,background:0.5'
+)
+
+fetch_scheduler = FetchScheduler(parse_tier_weights(UPSTREAM_TIER_WEIGHTS), upstream_rate_limiter)
+
+# Per-job upstream budgets by tier (0 = unlimited); requests may only tighten them
+JOB_MAX_UPSTREAM_CALLS = parse_tier_settings(
+    os.environ.get('JOB_MAX_UPSTREAM_CALLS', 'free:300,pro:1500,premium:5000,unlimited:5000,admin:0'), int
+)
+JOB_DEADLINE_SECONDS = parse_tier_settings(
+    os.environ.get('JOB_DEADLINE_SECONDS', 'free:300,pro:900,premium:1800,unlimited:1800,admin:0'), float
+)
+
+def job_budget(tier, config=None):
+    """(max_upstream_calls, deadline_seconds) for a job of the given tier"""
+    budget = []
+    for defaults, field in ((JOB_MAX_UPSTREAM_CALLS, 'max_upstream_calls'),
+                            (JOB_DEADLINE_SECONDS, 'deadline_seconds')):
+        limit = defaults.get(tier, defaults.get('free', 0))
+        try:
+            requested = float((config or {}).get(field) or 0)
+        except (TypeError, ValueError):
+            requested = 0
+        if requested > 0 and (limit <= 0 or requested < limit):
+            limit = requested
+        budget.append(limit)
+    return int(budget[0]), budget[1]
+
+class RoutePriceHistory:
+    """Cheapest fares seen per route, used to guess which dates are likely cheap.
+
+    Keeps exponentially weighted averages of the cheapest price per route
+    and per departure and return weekday. estimate() scales the route's
+    average by weekday factors, learned once a route has min_samples fares
+    and taken from typical weekday patterns before that. A route is
+    (origin, destination, trip, currency, seat class) and prices are kept
+    per passenger, so fares in other currencies, cabins or party sizes
+    never share an average.
+    """
+
+    # Typical fare factors by weekday (Monday first): midweek is cheapest
+    DEPART_FACTORS = [1.0, 0.95, 0.94, 1.0, 1.06, 1.02, 1.05]
+    RETURN_FACTORS = [1.04, 0.95, 0.95, 1.0, 1.03, 1.0, 1.07]
+
+    def __init__(self, alpha=0.3, min_samples=3, max_routes=5000, default_price=1000.0):
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.max_routes = max_routes
+        self.default_price = default_price
+        self._routes = OrderedDict()  # (origin, destination, trip, currency, seat) -> averages
+        self._lock = threading.Lock()
+        self.samples = 0
+
+    def _average(self, current, price):
+        return price if current is None else current + self.alpha * (price - current)
+
+    def record(self, key, price, depart_date, return_date=None, passengers=1):
+        """Add the cheapest price found for a query (dates as YYYY-MM-DD, price for all passengers)"""
+        if price is None:
+            return
+        price /= max(1, passengers)
+        with self._lock:
+            route = self._routes.get(key)
+            if route is None:
+                route = {'count': 0, 'mean': None, 'depart': [None] * 7, 'return': [None] * 7}
+                self._routes[key] = route
+                if len(self._routes) > self.max_routes:
+                    self._routes.popitem(last=False)
+            self._routes.move_to_end(key)
+
+            route['count'] += 1
+            route['mean'] = self._average(route['mean'], price)
+            weekday = datetime.strptime(depart_date, '%Y-%m-%d').weekday()
+            route['depart'][weekday] = self._average(route['depart'][weekday], price)
+            if return_date:
+                weekday = datetime.strptime(return_date, '%Y-%m-%d').weekday()
+                route['return'][weekday] = self._average(route['return'][weekday], price)
+            self.samples += 1
+
+    def _factor(self, route, kind, date_str, defaults):
+        weekday = datetime.strptime(date_str, '%Y-%m-%d').weekday()
+        if route is not None and route['count'] >= self.min_samples and route[kind][weekday] is not None:
+            return route[kind][weekday] / route['mean']
+        return defaults[weekday]
+
+    def estimate(self, key, depart_date, return_date=None, passengers=1):
+        """Likely cheapest price of a query on these dates, for all passengers"""
+        with self._lock:
+            route = self._routes.get(key)
+            price = route['mean'] if route is not None else self.default_price
+            price *= self._factor(route, 'depart', depart_date, self.DEPART_FACTORS)
+            if return_date:
+                price *= self._factor(route, 'return', return_date, self.RETURN_FACTORS)
+            return price * max(1, passengers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'routes': len(self._routes),
+                'samples': self.samples
+            }
+
+route_price_history = RoutePriceHistory()
+
+class TopKAggregator:
+    """Keeps the k cheapest items seen so far in a bounded heap.
+
+    Results can be added from several threads as they arrive; memory stays
+    O(k) however many are seen, and best() returns the current top k,
+    cheapest first, at any moment. Ties are broken by order (arrival order
+    by default), so the output does not depend on completion timing when
+    callers pass a stable order. k <= 0 keeps everything.
+    """
+
+    def __init__(self, k, price=None):
+        self.k = k
+        self.price = price or (lambda item: item)
+        self._heap = []  # (-price, negated order, item): the worst kept item is on top
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self.seen = 0
+
+    def admits(self, price):
+        """Whether an item at this price would currently be kept (not counted as seen)"""
+        with self._lock:
+            return self.k <= 0 or len(self._heap) < self.k or price < -self._heap[0][0]
+
+    def threshold(self):
+        """Price an item must beat to be kept (inf while there is still room)"""
+        with self._lock:
+            if self.k <= 0 or len(self._heap) < self.k:
+                return math.inf
+            return -self._heap[0][0]
+
+    def offer(self, price):
+        """Count a candidate and return whether one at this price would be kept"""
+        with self._lock:
+            self.seen += 1
+        return self.admits(price)
+
+    def note_seen(self, count):
+        """Count candidates that were ruled out without being offered one by one"""
+        with self._lock:
+            self.seen += count
+
+    def push(self, item, price=None, order=None):
+        """Insert an item that has already been offered"""
+        if price is None:
+            price = self.price(item)
+        if price is None:
+            price = float('inf')
+        if order is None:
+            order = (next(self._counter),)
+        entry = (-price, tuple(-part for part in order), item)
+        with self._lock:
+            if self.k <= 0 or len(self._heap) < self.k:
+                heapq.heappush(self._heap, entry)
+            elif entry[:2] > self._heap[0][:2]:
+                heapq.heapreplace(self._heap, entry)
+
+    def add(self, item, price=None, order=None):
+        if price is None:
+            price = self.price(item)
+        if price is None:
+            price = float('inf')
+        if self.offer(price):
+            self.push(item, price, order)
+
+    def add_all(self, items, order=None):
+        """Add a batch of items (e.g. one combination's flights), keeping their relative order"""
+        if order is None:
+            order = next(self._counter)
+        for rank, item in enumerate(items):
+            self.add(item, order=(order, rank))
+
+    def best(self):
+        with self._lock:
+            entries = sorted(self._heap, key=lambda entry: (-entry[0], tuple(-part for part in entry[1])))
+        return [entry[2] for entry in entries]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+def result_limit(config):
+    """Number of results a range or multi-city job keeps (top_k in the request, else RESULTS_TOP_K)"""
+    try:
+        return int(config.get('top_k') or RESULTS_TOP_K)
+    except (TypeError, ValueError):
+        return RESULTS_TOP_K
+
+def combination_beam_width(config):
+    """Cheapest flights per leg considered when combining multi-city legs (beam_width in the request)"""
+    try:
+        return max(1, int(config.get('beam_width') or MULTI_CITY_BEAM_WIDTH))
+    except (TypeError, ValueError):
+        return MULTI_CITY_BEAM_WIDTH
+
+def combination_order(config):
+    """'price' to search likely-cheapest combinations first, 'calendar' for date order"""
+    order = config.get('combination_order') or COMBINATION_ORDER
+    return order if order in ('price', 'calendar') else 'price'
+
+def combination_limits(config):
+    """Total duration (minutes) and total stops a multi-city combination may have (0 / -1 = no limit)"""
+    try:
+        max_total_minutes = int(float(config.get('max_total_duration_hours') or 0) * 60)
+    except (TypeError, ValueError):
+        max_total_minutes = 0
+    try:
+        max_total_stops = int(config.get('max_total_stops', -1))
+    except (TypeError, ValueError):
+        max_total_stops = -1
+    return {'max_total_minutes': max_total_minutes, 'max_total_stops': max_total_stops}
+
+class SearchJobContext:
+    """Per-job state shared by the fetch helpers of a single search"""
+
+    def __init__(self, job_id=None, config=None):
+        self.job_id = job_id
+        self.tier = fetch_scheduler.tier_for_job(job_id)
+        self.max_upstream_calls, self.deadline_seconds = job_budget(self.tier, config)
+        self.started_at = time.monotonic()
+        self.upstream_calls = 0
+        self.stop_reason = None  # set once the budget has run out
+        self.combinations_searched = 0
+        self.combinations_total = None
+        self.legs = {}  # (origin, destination, date) -> flights list or exception
+        self.planned = {}  # query cache key -> Result or exception fetched by execute_plan
+        self.ranked_legs = {}  # id(flights) -> (flights, candidates) prepared for combining
+        self.retries = {}  # label -> number of retried upstream attempts
+        self.failures = {}  # label -> error message
+        self.stale_age = None  # age in seconds of the oldest stale cache entry served
+        self._lock = threading.Lock()
+
+    def out_of_budget(self):
+        """True once the call budget is spent or the deadline has passed"""
+        with self._lock:
+            if self.stop_reason is None and self.deadline_seconds > 0 \
+                    and time.monotonic() - self.started_at >= self.deadline_seconds:
+                self.stop_reason = 'deadline'
+            return self.stop_reason is not None
+
+    def spend_upstream_call(self):
+        """Count one upstream attempt against the budget, raising JobBudgetExceeded when exhausted"""
+        if self.out_of_budget():
+            raise JobBudgetExceeded(self.stop_reason, self)
+        with self._lock:
+            if self.max_upstream_calls > 0 and self.upstream_calls >= self.max_upstream_calls:
+                self.stop_reason = 'max_upstream_calls'
+                raise JobBudgetExceeded(self.stop_reason, self)
+            self.upstream_calls += 1
+
+    def try_spend_upstream_call(self):
+        """Count an optional upstream attempt (a hedge) if the budget has room; never stops the job"""
+        if self.out_of_budget():
+            return False
+        with self._lock:
+            if self.max_upstream_calls > 0 and self.upstream_calls >= self.max_upstream_calls:
+                return False
+            self.upstream_calls += 1
+            return True
+
+    def note_coverage(self, searched, total):
+        with self._lock:
+            self.combinations_searched = searched
+            self.combinations_total = total
+
+    def note_stale(self, age):
+        with self._lock:
+            self.stale_age = max(age, self.stale_age or 0)
+
+    def note_retry(self, label):
+        if label is None:
+            return
+        with self._lock:
+            self.retries[label] = self.retries.get(label, 0) + 1
+
+    def note_failure(self, label, error):
+        """Record a combination lost to an upstream error (empty results are not failures)"""
+        if is_no_flights_error(error) or isinstance(error, JobBudgetExceeded):
+            return
+        with self._lock:
+            self.failures[label] = str(error)
+
+    def fetch_report(self):
+        """Retried and failed combinations and budget coverage, for inclusion in the job result"""
+        with self._lock:
+            coverage = {
+                'upstream_calls': self.upstream_calls,
+                'max_upstream_calls': self.max_upstream_calls,
+                'deadline_seconds': self.deadline_seconds,
+                'elapsed_seconds': round(time.monotonic() - self.started_at, 1)
+            }
+            if self.combinations_total is not None:
+                coverage['combinations_searched'] = self.combinations_searched
+                coverage['combinations_total'] = self.combinations_total
+            if self.legs:
+                coverage['legs_total'] = len(self.legs)
+                coverage['legs_searched'] = sum(
+                    1 for leg in self.legs.values() if not isinstance(leg, JobBudgetExceeded)
+                )
+            return {
+                'partial': self.stop_reason is not None,
+                'stop_reason': self.stop_reason,
+                'coverage': coverage,
+                'retried_combinations': [
+                    {'combination': label, 'retries': count} for label, count in self.retries.items()
+                ],
+                'failed_combinations': [
+                    {'combination': label, 'error': error} for label, error in self.failures.items()
+                ]
+            }
+
+    def get_leg(self, leg_key, fetch):
+        """Return the memoized flights for a leg, calling fetch() only once"""
+        return self._memoized(self.legs, leg_key, fetch)
+
+    def get_planned(self, cache_key, fetch):
+        """Return the memoized Result of a planned query, calling fetch() only once"""
+        return self._memoized(self.planned, cache_key, fetch)
+
+    def planned_result(self, cache_key):
+        """Result execute_plan fetched for a query (raising its error), or None if not fetched"""
+        with self._lock:
+            cached = self.planned.get(cache_key)
+        if isinstance(cached, Exception):
+            raise cached
+        return cached
+
+    def pop_planned(self, cache_key):
+        """Remove and return a planned query's Result (None for a failed or unfetched query)"""
+        with self._lock:
+            cached = self.planned.pop(cache_key, None)
+        return None if isinstance(cached, Exception) else cached
+
+    def _memoized(self, store, key, fetch):
+        with self._lock:
+            if key in store:
+                cached = store[key]
+                if isinstance(cached, Exception):
+                    raise cached
+                return cached
+
+        try:
+            value = fetch()
+        except Exception as e:
+            # Remember failures too, so a dead query is not retried for every combination
+            with self._lock:
+                store[key] = e
+            raise
+
+        with self._lock:
+            store[key] = value
+        return value
+
+    def legs_fetched(self):
+        with self._lock:
+            return len(self.legs)
+
+    def get_ranked_leg(self, flights, rank):
+        """Return rank(flights), computed once per flights list of this job"""
+        with self._lock:
+            entry = self.ranked_legs.get(id(flights))
+            if entry is not None and entry[0] is flights:
+                return entry[1]
+
+        ranked = rank(flights)
+        with self._lock:
+            # Keeping the list alive keeps its id from being reused
+            self.ranked_legs[id(flights)] = (flights, ranked)
+        return ranked
+
+class QueryPlan:
+    """Deduplicated upstream queries a search request needs, and how they are combined.
+
+    Built by FlightSearchEngine.plan_search without calling upstream. A query
+    shared by several combinations appears once. followup_queries is the most
+    a data-dependent search (adaptive refinement, one-way verification) may
+    add once the planned results are in.
+    """
+
+    def __init__(self, search_type, combiner, combinations=0):
+        self.search_type = search_type
+        self.combiner = combiner
+        self.combinations = combinations
+        self.followup_queries = 0
+        self.requested = 0
+        self.queries = OrderedDict()  # cache key -> planned query
+
+    def add(self, cache_key, filter_data, currency, label, departure_date, leg=None, mode="common", combination=None):
+        """Plan a query, once however many combinations need it"""
+        self.requested += 1
+        if cache_key not in self.queries:
+            self.queries[cache_key] = {
+                'key': cache_key,
+                'filter_data': filter_data,
+                'currency': currency,
+                'mode': mode,
+                'label': label,
+                'departure_date': departure_date,
+                'leg': leg,  # (origin, destination, date) for one-way legs memoized per job
+                'combinations': []  # indices of the search's combinations answered by this query
+            }
+        if combination is not None:
+            self.queries[cache_key]['combinations'].append(combination)
+
+    def sort(self, key):
+        """Reorder the planned queries by key(query); execution follows this order"""
+        self.queries = OrderedDict(sorted(self.queries.items(), key=lambda item: key(item[1])))
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __iter__(self):
+        return iter(list(self.queries.values()))
+
+    def to_dict(self, cached_keys=None):
+        cached_keys = cached_keys or set()
+        return {
+            'search_type': self.search_type,
+            'combiner': self.combiner,
+            'combinations': self.combinations,
+            'queries_requested': self.requested,
+            'unique_queries': len(self.queries),
+            'cached_queries': sum(1 for key in self.queries if key in cached_keys),
+            'followup_queries': self.followup_queries,
+            'queries': [
+                {
+                    'label': query['label'],
+                    'departure_date': query['departure_date'],
+                    'cached': key in cached_keys
+                }
+                for key, query in self.queries.items()
+            ]
+        }
+
+class JobQueueFull(Exception):
+    """Raised by a job queue's submit when it is full; retry_after is a suggested wait in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Search queue is full, retry in {retry_after} seconds')
+        self.retry_after = retry_after
+
+class JobQueue:
+    """Bounded FIFO admission of search jobs, with queue positions and run-time stats.
+
+    At most workers jobs run at once and at most max_queued more wait;
+    submit raises JobQueueFull beyond that. Subclasses decide what runs a job.
+    """
+
+    def __init__(self, workers, max_queued):
+        self.workers = max(1, workers)
+        self.max_queued = max(0, max_queued)
+        self._queue = deque()  # (job_id, run)
+        self._running = set()
+        self._cond = threading.Condition()
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.average_seconds = None  # moving average of job run time
+
+    def _enqueue(self, job_id, run):
+        """Queue a job or raise JobQueueFull; the caller holds self._cond"""
+        if len(self._queue) + len(self._running) >= self.workers + self.max_queued:
+            self.rejected += 1
+            raise JobQueueFull(max(1, math.ceil((self.average_seconds or 30) / self.workers)))
+        self._queue.append((job_id, run))
+        self.submitted += 1
+
+    def _finished(self, job_id, elapsed):
+        with self._cond:
+            self._running.discard(job_id)
+            self.completed += 1
+            self.average_seconds = elapsed if self.average_seconds is None \
+                else self.average_seconds + 0.2 * (elapsed - self.average_seconds)
+
+    def position(self, job_id):
+        """(queue position, estimated wait seconds) of a waiting job; position 0 while running, None if unknown"""
+        with self._cond:
+            if job_id in self._running:
+                return 0, 0
+            for position, (queued_id, _) in enumerate(self._queue, start=1):
+                if queued_id == job_id:
+                    return position, math.ceil((self.average_seconds or 30) * position / self.workers)
+            return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'running': len(self._running),
+                'queued': len(self._queue),
+                'max_queued': self.max_queued,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'average_job_seconds': round(self.average_seconds, 1) if self.average_seconds is not None else None
+            }
+
+class JobExecutor(JobQueue):
+    """Fixed pool of worker threads running search jobs from a bounded FIFO queue.
+
+    Jobs beyond the pool wait in the queue instead of each getting its own
+    thread, so at most workers searches hit the upstream at once however
+    many users submit; submit raises JobQueueFull once max_queued are waiting.
+    """
+
+    def __init__(self, workers=4, max_queued=50):
+        super().__init__(workers, max_queued)
+        for index in range(self.workers):
+            threading.Thread(target=self._worker, name=f'search-job-{index}', daemon=True).start()
+
+    def submit(self, job_id, run):
+        """Queue run() for a worker, or raise JobQueueFull"""
+        with self._cond:
+            self._enqueue(job_id, run)
+            self._cond.notify()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                job_id, run = self._queue.popleft()
+                self._running.add(job_id)
+
+            started = time.monotonic()
+            try:
+                run()
+            except Exception as e:
+                print(f"Search job {job_id} crashed: {e}")
+            finally:
+                self._finished(job_id, time.monotonic() - started)
+
+class AsyncJobQueue(JobQueue):
+    """Job queue for the asyncio engine: jobs are started as tasks on its event loop.
+
+    A job waits for a free slot in the queue and then runs as a coroutine,
+    so neither waiting nor running holds an OS thread, and the number of
+    slots is sized separately from the threaded JOB_WORKERS.
+    """
+
+    def __init__(self, loop, workers=50, max_queued=50):
+        super().__init__(workers, max_queued)
+        self._loop = loop
+        self._tasks = set()  # strong references, so running jobs are not garbage collected
+
+    def submit(self, job_id, run):
+        """Queue run(), a coroutine function, for the loop, or raise JobQueueFull"""
+        with self._cond:
+            self._enqueue(job_id, run)
+        self._loop.call_soon_threadsafe(self._dispatch)
+
+    def _dispatch(self):
+        """Start queued jobs while slots are free (runs on the loop)"""
+        with self._cond:
+            while self._queue and len(self._running) < self.workers:
+                job_id, run = self._queue.popleft()
+                self._running.add(job_id)
+                task = self._loop.create_task(self._run(job_id, run))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job_id, run):
+        started = time.monotonic()
+        try:
+            await run()
+        except Exception as e:
+            print(f"Search job {job_id} crashed: {e}")
+        finally:
+            self._finished(job_id, time.monotonic() - started)
+            self._dispatch()
+
 class FlightSearchEngine:
     def __init__(self):
         self.setup_dependencies()
@@ -227,13 +1781,14 @@ class FlightSearchEngine:
         try:
             from fast_flights.flights_impl import FlightData, Passengers, TFSData
             from fast_flights.core import get_flights, get_flights_from_filter
-            from fast_flights.schema import Result
+            from fast_flights.schema import Result, Flight
             self.FlightData = FlightData
             self.Passengers = Passengers
             self.TFSData = TFSData
             self.get_flights = get_flights
             self.get_flights_from_filter = get_flights_from_filter
             self.Result = Result
+            self.Flight = Flight
             print("Flight search engine initialized")
         except ImportError as e:
             print(f"Installing dependencies: {e}")
@@ -242,13 +1797,14 @@ class FlightSearchEngine:
             try:
                 from fast_flights.flights_impl import FlightData, Passengers, TFSData
                 from fast_flights.core import get_flights, get_flights_from_filter
-                from fast_flights.schema import Result
+                from fast_flights.schema import Result, Flight
                 self.FlightData = FlightData
                 self.Passengers = Passengers
                 self.TFSData = TFSData
                 self.get_flights = get_flights
                 self.get_flights_from_filter = get_flights_from_filter
                 self.Result = Result
+                self.Flight = Flight
                 print("Flight search engine initialized after installation")
             except ImportError as e2:
                 print(f"Failed to initialize after installation: {e2}")
@@ -260,215 +1816,451 @@ class FlightSearchEngine:
         except subprocess.CalledProcessError:
             print("Failed to install dependencies")
     
+    def start_job(self, method_name, config, job_id, on_complete, on_error, tier='free'):
+        """Queue a search method on the shared job executor (raises JobQueueFull)"""
+        def background_search():
+            fetch_scheduler.assign_job(job_id, tier)
+            try:
+                result = getattr(self, method_name)(config, job_id=job_id)
+                on_complete(result)
+            except Exception as e:
+                on_error(e)
+            finally:
+                fetch_scheduler.release_job(job_id)
+
+        job_executor.submit(job_id, background_search)
+    
     def search_date_range(self, config, job_id=None):
         """Advanced search across date ranges"""
-        from datetime import datetime, timedelta
-        import itertools
+        if config.get('date_sampling') == 'adaptive':
+            return self._search_date_range_adaptive(config, job_id)
+        if config.get('date_sampling') == 'one-way':
+            return self._search_date_range_one_way(config, job_id)
         
         try:
-            passengers = self.Passengers(
-                adults=config.get('adults', 1),
-                children=config.get('children', 0),
-                infants_in_seat=config.get('infants_seat', 0),
-                infants_on_lap=config.get('infants_lap', 0)
-            )
+            passengers, max_stops, all_combinations = self._prepare_date_range(config)
+            total_combinations = len(all_combinations)
+            job_ctx = SearchJobContext(job_id, config)
             
-            max_stops = config.get('max_stops')
-            if max_stops == -1:
-                max_stops = None
+            # No more limiting - we'll test all combinations!
             
-            # Parse date ranges
-            start_period = datetime.strptime(config['start_period'], '%Y-%m-%d')
-            end_period = datetime.strptime(config['end_period'], '%Y-%m-%d')
-            min_days = int(config.get('min_vacation_days', 7))
-            max_days = int(config.get('max_vacation_days', 21))
+            best_flights = self._range_results(config)
+            workers = self._range_worker_count(config)
+            if workers > 1:
+                print(f"Running {total_combinations} combinations on {workers} concurrent workers")
             
-            # Generate date combinations
-            all_combinations = []
-            current_date = start_period
+            on_fetched, counts = self._range_plan_collector(
+                config, all_combinations, job_id, job_ctx, best_flights
+            )
+            self.execute_plan(self._range_plan(config, all_combinations), job_ctx, workers, on_fetched=on_fetched)
+            if job_ctx.stop_reason is not None:
+                print(f"Search budget exhausted ({job_ctx.stop_reason}) after {counts['searched']} combinations")
+            job_ctx.note_coverage(counts['searched'], total_combinations)
             
-            print(f"Searching period: {start_period.date()} to {end_period.date()}")
-            print(f"Vacation length: {min_days}-{max_days} days")
+            return self._complete_date_range(best_flights, total_combinations, job_id, job_ctx)
             
-            while current_date <= end_period:
-                for vacation_days in range(min_days, max_days + 1):
-                    return_date = current_date + timedelta(days=vacation_days)
-                    if return_date <= end_period:
-                        all_combinations.append((current_date.strftime('%Y-%m-%d'), 
-                                              return_date.strftime('%Y-%m-%d'), 
-                                              vacation_days))
-                current_date += timedelta(days=3)  # Check every 3 days
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'flights': [],
+                'total_found': 0,
+                'search_type': 'date_range'
+            }
+    
+    def _search_passengers(self, config):
+        """Passengers and max stops (None = any) for a search config"""
+        passengers = self.Passengers(
+            adults=config.get('adults', 1),
+            children=config.get('children', 0),
+            infants_in_seat=config.get('infants_seat', 0),
+            infants_on_lap=config.get('infants_lap', 0)
+        )
+        
+        max_stops = config.get('max_stops')
+        if max_stops == -1:
+            max_stops = None
+        
+        return passengers, max_stops
+
+    def _prepare_date_range(self, config):
+        """Build passengers, max stops and the (departure, return, days) combinations"""
+        passengers, max_stops = self._search_passengers(config)
+        
+        print(f"Searching period: {config['start_period']} to {config['end_period']}")
+        print(f"Vacation length: {config.get('min_vacation_days', 7)}-{config.get('max_vacation_days', 21)} days")
+        
+        all_combinations = self._date_range_combinations(config)
+        if combination_order(config) == 'price':
+            all_combinations = self._order_by_likely_price(config, all_combinations)
+        
+        total_combinations = len(all_combinations)
+        print(f"Generated {total_combinations} date combinations to test")
+        print(f"Will search ALL combinations (no limit applied)")
+        
+        return passengers, max_stops, all_combinations
+
+    def _order_by_likely_price(self, config, combinations):
+        """Sort (departure, return, days) combinations likely-cheapest first"""
+        def likely_price(combination):
+            dep_date, ret_date, _ = combination
+            filter_data, currency = self._build_search_filter(
+                dict(config, departure_date=dep_date, return_date=ret_date, trip_type='round-trip')
+            )
+            return self._likely_price(filter_data, currency)
+
+        return sorted(combinations, key=likely_price)
+
+    def _date_range_combinations(self, config):
+        """(departure, return, days) combinations for a date range search config"""
+        from datetime import datetime, timedelta
+        
+        # Parse date ranges
+        start_period = datetime.strptime(config['start_period'], '%Y-%m-%d')
+        end_period = datetime.strptime(config['end_period'], '%Y-%m-%d')
+        min_days = int(config.get('min_vacation_days', 7))
+        max_days = int(config.get('max_vacation_days', 21))
+        
+        # Generate date combinations
+        all_combinations = []
+        current_date = start_period
+        
+        while current_date <= end_period:
+            for vacation_days in range(min_days, max_days + 1):
+                return_date = current_date + timedelta(days=vacation_days)
+                if return_date <= end_period:
+                    all_combinations.append((current_date.strftime('%Y-%m-%d'), 
+                                          return_date.strftime('%Y-%m-%d'), 
+                                          vacation_days))
+            current_date += timedelta(days=3)  # Check every 3 days
+        
+        return all_combinations
+
+    def _range_results(self, config):
+        """Top-K aggregator for range search flights, cheapest first"""
+        return TopKAggregator(result_limit(config), price=lambda flight: self._parse_price_value(flight['price']))
+
+    def _complete_date_range(self, best_flights, total_combinations, job_id=None, job_ctx=None):
+        """Send the completion update and build the response from the top-K results"""
+        all_results = best_flights.best()
+        
+        # Only print final results in local environment
+        if os.environ.get('PORT') is None:
+            print("\nSearch completed.")
+            print(f"Total combinations tested: {total_combinations}")
+            print(f"Flights found: {best_flights.seen}")
+            print(f"Returning the best {len(all_results)} results to frontend")
+        
+        # Send completion update
+        stopped_early = job_ctx is not None and job_ctx.stop_reason is not None
+        send_progress_update(
+            current=total_combinations,
+            total=total_combinations,
+            current_dates="Search budget reached - showing best results so far" if stopped_early else "Search completed!",
+            status="completed",
+            flights_found=best_flights.seen,
+            job_id=job_id
+        )
+        
+        return {
+            'success': True,
+            'flights': all_results,
+            'total_found': best_flights.seen,
+            'total_combinations_tested': total_combinations,
+            'search_type': 'date_range',
+            **(job_ctx.fetch_report() if job_ctx else {})
+        }
+
+    def _search_date_range_adaptive(self, config, job_id=None):
+        """Coarse-to-fine date range search.
+
+        Samples a coarse grid of departure offsets and vacation lengths, then
+        repeatedly halves the step around the cheapest combinations found so
+        far, spending the sample budget (a share of the exhaustive 1-day grid)
+        where fares are lowest instead of on a fixed stride.
+        """
+        try:
+            passengers, max_stops = self._search_passengers(config)
+            job_ctx = SearchJobContext(job_id, config)
+            workers = self._range_worker_count(config)
             
-            total_combinations = len(all_combinations)
-            print(f"Generated {total_combinations} date combinations to test")
-            print(f"Will search ALL combinations (no limit applied)")
+            grid = self._adaptive_grid(config)
+            start_period, valid = grid['start_period'], grid['valid']
+            exhaustive, budget, coarse = grid['exhaustive'], grid['budget'], grid['coarse']
+            dep_step, len_step = grid['dep_step'], grid['len_step']
             
-            # No more limiting - we'll test all combinations!
+            print(f"Adaptive date sampling: budget {budget} of {exhaustive} combinations, "
+                  f"{len(coarse)} in the coarse grid")
             
-            all_results = []
+            prices = {}  # (offset, days) -> cheapest price, or None when nothing was found
+            best_flights = self._range_results(config)
+            phases = {
+                phase: {'rounds': 0, 'combinations': 0, 'upstream_calls': 0}
+                for phase in ('coarse', 'refine')
+            }
             
-            for i, (dep_date, ret_date, days) in enumerate(all_combinations):
-                # Progress bar calculation
-                progress_percent = ((i + 1) / total_combinations) * 100
-                progress_bar_length = 30
-                filled_length = int(progress_bar_length * (i + 1) // total_combinations)
-                bar = '=' * filled_length + '-' * (progress_bar_length - filled_length)
+            def sample(points, phase):
+                """Search points in order, stopping at the sample or job budget"""
+                points = points[:budget - len(prices)]
+                calls_before = job_ctx.upstream_calls
                 
-                # Only print progress in local environment
-                if os.environ.get('PORT') is None:  # Local environment
-                    print(f"[{bar}] {progress_percent:.1f}% ({i+1}/{total_combinations})")
-                    print(f"Testing: {dep_date} -> {ret_date} ({days} days)")
+                def run(point):
+                    offset, days = point
+                    dep_date = (start_period + timedelta(days=offset)).strftime('%Y-%m-%d')
+                    ret_date = (start_period + timedelta(days=offset + days)).strftime('%Y-%m-%d')
+                    try:
+                        return dep_date, ret_date, self._search_range_combination(
+                            config, passengers, max_stops, dep_date, ret_date, days, job_ctx
+                        ), None
+                    except Exception as e:
+                        return dep_date, ret_date, [], e
                 
-                # Send real-time progress update
-                send_progress_update(
-                    current=i + 1,
-                    total=total_combinations,
-                    current_dates=f"{dep_date} -> {ret_date} ({days} days)",
-                    status="searching",
-                    flights_found=len(all_results),
-                    job_id=job_id
-                )
+                if workers > 1 and len(points) > 1:
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        outcomes = list(executor.map(run, points))
+                else:
+                    outcomes = []
+                    for point in points:
+                        outcomes.append(run(point))
+                        if isinstance(outcomes[-1][3], JobBudgetExceeded):
+                            break
                 
-                try:
-                    flight_data = [
-                        self.FlightData(
-                            date=dep_date,
-                            from_airport=config['from_airport'],
-                            to_airport=config['to_airport'],
-                            max_stops=max_stops
-                        ),
-                        self.FlightData(
-                            date=ret_date,
-                            from_airport=config['to_airport'],
-                            to_airport=config['from_airport'],
-                            max_stops=max_stops
-                        )
-                    ]
-                    
-                    # Convert currency for API
-                    api_currency = config.get('currency', 'ILS')
-                    
-                    # Use get_flights_from_filter to pass currency
-                    filter_data = self.TFSData.from_interface(
-                        flight_data=flight_data,
-                        trip="round-trip",
-                        passengers=passengers,
-                        seat=config['seat_class'],
-                        max_stops=max_stops
-                    )
-                    
-                    result = self.get_flights_from_filter(
-                        filter_data,
-                        currency=api_currency,
-                        mode="common"
-                    )
-                    
-                    if hasattr(result, 'flights') and result.flights:
-                        # Process TOP 10 flights from this combination (cheapest first)
-                        top_flights = result.flights[:10]  # Take only top 10 cheapest
-                        for flight_idx, flight in enumerate(top_flights):
-                            # Generate booking URL
-                            booking_url = self.generate_booking_url(config['from_airport'], 
-                                                                  config['to_airport'], 
-                                                                  dep_date, ret_date,
-                                                                  config.get('adults', 1),
-                                                                  config['seat_class'],
-                                                                  config.get('currency', 'ILS'))
-                            
-                            # Parse flight details for round-trip
-                            flight_details = self.parse_round_trip_details(flight, dep_date, ret_date)
-                            
-                            flight_info = {
-                                'departure_date': dep_date,
-                                'return_date': ret_date,
-                                'vacation_days': days,
-                                'airline': getattr(flight, 'name', 'Unknown'),
-                                'price': getattr(flight, 'price', 'N/A'),
-                                'duration': getattr(flight, 'duration', 'N/A'),
-                                'stops': getattr(flight, 'stops', 'N/A'),
-                                'departure': getattr(flight, 'departure', 'N/A'),
-                                'arrival': getattr(flight, 'arrival', 'N/A'),
-                                'is_best': getattr(flight, 'is_best', False),
-                                'price_level': getattr(result, 'current_price', 'typical'),
-                                'booking_url': booking_url,
-                                'combination_rank': flight_idx + 1,  # Rank within this combination
-                                'total_options_in_combination': len(result.flights),
-                                'outbound_details': flight_details['outbound'],
-                                'return_details': flight_details['return']
-                            }
-                            all_results.append(flight_info)
-                        
-                        # Only print in local environment
-                        if os.environ.get('PORT') is None:
-                            print(f"  [OK] Found {len(result.flights)} flights, took top {len(top_flights)} for this combination")
-                        
-                        # Update progress with found flights
-                        send_progress_update(
-                            current=i + 1,
-                            total=total_combinations,
-                            current_dates=f"{dep_date} -> {ret_date} ({days} days)",
-                            status="found_flights",
-                            flights_found=len(all_results),
-                            job_id=job_id
-                        )
-                        
-                except Exception as e:
-                    # Only print errors in local environment
-                    if os.environ.get('PORT') is None:
-                        print(f"  [ERROR] {e}")
-                    
-                    # Update progress with error
+                sampled = 0
+                for point, (dep_date, ret_date, flights, error) in zip(points, outcomes):
+                    if isinstance(error, JobBudgetExceeded):
+                        continue
+                    if error is not None:
+                        job_ctx.note_failure(f"{dep_date} -> {ret_date}", error)
+                    sampled += 1
+                    best_flights.add_all(flights)
+                    found = [price for price in (self._parse_price_value(f['price']) for f in flights)
+                             if price is not None]
+                    prices[point] = min(found) if found else None
                     send_progress_update(
-                        current=i + 1,
-                        total=total_combinations,
-                        current_dates=f"{dep_date} -> {ret_date} ({days} days)",
-                        status="error",
-                        flights_found=len(all_results),
+                        current=len(prices),
+                        total=budget,
+                        current_dates=f"{dep_date} -> {ret_date} ({point[1]} days, {phase})",
+                        status="found_flights" if flights else "searching",
+                        flights_found=best_flights.seen,
                         job_id=job_id
                     )
+                
+                phases[phase]['rounds'] += 1
+                phases[phase]['combinations'] += sampled
+                phases[phase]['upstream_calls'] += job_ctx.upstream_calls - calls_before
+            
+            sample(coarse, 'coarse')
+            
+            # Refine around the cheapest combinations, halving the step each round
+            while len(prices) < budget and not job_ctx.out_of_budget():
+                dep_step = max(1, dep_step // 2)
+                len_step = max(1, len_step // 2)
+                
+                candidates = []
+                regions = 0
+                for _, (offset, days) in sorted((price, point) for point, price in prices.items()
+                                                if price is not None):
+                    neighbours = [
+                        (offset + d_offset, days + d_days)
+                        for d_offset in (-dep_step, 0, dep_step)
+                        for d_days in (-len_step, 0, len_step)
+                    ]
+                    new = [point for point in neighbours
+                           if valid(point) and point not in prices and point not in candidates]
+                    if new:
+                        candidates.extend(new)
+                        regions += 1
+                        if regions >= ADAPTIVE_REFINE_REGIONS:
+                            break
+                
+                if not candidates:
+                    if dep_step == 1 and len_step == 1:
+                        break  # Every neighbourhood of a priced combination is explored
+                    continue
+                
+                sample(candidates, 'refine')
+            
+            job_ctx.note_coverage(len(prices), exhaustive)
+            result = self._complete_date_range(best_flights, len(prices), job_id, job_ctx)
+            result['sampling'] = {
+                'mode': 'adaptive',
+                'sample_budget': budget,
+                'exhaustive_combinations': exhaustive,
+                'combinations_sampled': len(prices),
+                'phases': phases
+            }
+            return result
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'flights': [],
+                'total_found': 0,
+                'search_type': 'date_range'
+            }
+
+    def _adaptive_grid(self, config):
+        """Sample budget and coarse (departure offset, days) grid of an adaptive range search"""
+        start_period = datetime.strptime(config['start_period'], '%Y-%m-%d')
+        span = (datetime.strptime(config['end_period'], '%Y-%m-%d') - start_period).days
+        min_days = int(config.get('min_vacation_days', 7))
+        max_days = int(config.get('max_vacation_days', 21))
+        
+        def valid(point):
+            offset, days = point
+            return offset >= 0 and min_days <= days <= max_days and offset + days <= span
+        
+        exhaustive = sum(max(0, span - days + 1) for days in range(min_days, max_days + 1))
+        budget = int(config.get('sample_budget') or 0) or max(1, math.ceil(exhaustive * ADAPTIVE_SAMPLE_FRACTION))
+        budget = min(budget, exhaustive)
+        
+        dep_step = max(1, ADAPTIVE_COARSE_STEP_DAYS)
+        len_step = max(1, dep_step // 2)
+        lengths = sorted(set(list(range(min_days, max_days + 1, len_step)) + [max_days]))
+        coarse = [(offset, days) for offset in range(0, span + 1, dep_step) for days in lengths
+                  if valid((offset, days))]
+        
+        return {
+            'start_period': start_period,
+            'valid': valid,
+            'exhaustive': exhaustive,
+            'budget': budget,
+            'coarse': coarse[:budget],
+            'dep_step': dep_step,
+            'len_step': len_step
+        }
+
+    def _one_way_range_legs(self, config):
+        """(origin, destination, date) one-way legs a one-way decomposition range search prices"""
+        origin, destination = config['from_airport'], config['to_airport']
+        start_period = datetime.strptime(config['start_period'], '%Y-%m-%d')
+        span = (datetime.strptime(config['end_period'], '%Y-%m-%d') - start_period).days
+        min_days = int(config.get('min_vacation_days', 7))
+        
+        def date_at(offset):
+            return (start_period + timedelta(days=offset)).strftime('%Y-%m-%d')
+        
+        legs = [(origin, destination, date_at(offset)) for offset in range(0, span - min_days + 1)]
+        legs += [(destination, origin, date_at(offset)) for offset in range(min_days, span + 1)]
+        return legs
+
+    def _search_date_range_one_way(self, config, job_id=None):
+        """Round-trip range search composed from one-way fares.
+
+        Fetches one-way prices once per outbound and once per return date,
+        ranks every (departure, return) pair by the sum of the cheapest
+        one-way fares, and verifies only the top pairs with real round-trip
+        queries, which become the results.
+        """
+        try:
+            passengers, max_stops = self._search_passengers(config)
+            job_ctx = SearchJobContext(job_id, config)
+            workers = self._range_worker_count(config)
+            api_currency = config.get('currency', 'ILS')
+            origin, destination = config['from_airport'], config['to_airport']
+            
+            start_period = datetime.strptime(config['start_period'], '%Y-%m-%d')
+            span = (datetime.strptime(config['end_period'], '%Y-%m-%d') - start_period).days
+            min_days = int(config.get('min_vacation_days', 7))
+            max_days = int(config.get('max_vacation_days', 21))
+            verify_top = int(config.get('verify_top') or ONE_WAY_VERIFY_TOP)
+            
+            def date_at(offset):
+                return (start_period + timedelta(days=offset)).strftime('%Y-%m-%d')
+            
+            legs = self._one_way_range_legs(config)
+            total_steps = len(legs) + verify_top
+            
+            def map_in_order(fn, items):
+                if workers > 1 and len(items) > 1:
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        return list(executor.map(fn, items))
+                return [fn(item) for item in items]
+            
+            # Phase 1: cheapest one-way fare per (direction, date)
+            def fetch_leg(leg):
+                try:
+                    flights = self._fetch_one_way_flights(*leg, passengers, config['seat_class'],
+                                                          max_stops, api_currency, job_ctx)
+                except Exception as e:
+                    job_ctx.note_failure(f"{leg[0]} -> {leg[1]} {leg[2]}", e)
+                    return None
+                prices = [price for price in (self._parse_price_value(getattr(f, 'price', None)) for f in flights)
+                          if price is not None]
+                return min(prices) if prices else None
+            
+            one_way_prices = {}
+            for step, (leg, price) in enumerate(zip(legs, map_in_order(fetch_leg, legs)), start=1):
+                one_way_prices[leg] = price
+                send_progress_update(
+                    current=step,
+                    total=total_steps,
+                    current_dates=f"One-way {leg[0]} -> {leg[1]} {leg[2]}",
+                    status="searching",
+                    flights_found=0,
+                    job_id=job_id
+                )
+            one_way_calls = job_ctx.upstream_calls
+            
+            # Phase 2: compose round trips in memory and rank by estimated price
+            candidates = []
+            for offset in range(0, span - min_days + 1):
+                outbound = one_way_prices.get((origin, destination, date_at(offset)))
+                if outbound is None:
                     continue
-                
-                # Small delay to allow UI updates
-                import time
-                time.sleep(0.2)  # 200ms delay
+                for days in range(min_days, min(max_days, span - offset) + 1):
+                    inbound = one_way_prices.get((destination, origin, date_at(offset + days)))
+                    if inbound is not None:
+                        candidates.append((outbound + inbound, date_at(offset), date_at(offset + days), days))
+            candidates.sort()
+            to_verify = candidates[:verify_top]
+            print(f"One-way decomposition: {len(legs)} one-way queries, {len(candidates)} round trips composed, "
+                  f"verifying top {len(to_verify)}")
             
-            # Sort by price (extract numeric value)
-            def extract_price(price_str):
+            # Phase 3: verify the most promising pairs with real round-trip queries
+            def verify(candidate):
+                _, dep_date, ret_date, days = candidate
                 try:
-                    import re
-                    numbers = re.findall(r'[\d,]+', price_str)
-                    if numbers:
-                        return int(numbers[0].replace(',', ''))
-                    return float('inf')
-                except:
-                    return float('inf')
-            
-            all_results.sort(key=lambda x: extract_price(x['price']))
-            
-            # Only print final results in local environment
-            if os.environ.get('PORT') is None:
-                print("\nSearch completed.")
-                print(f"Total combinations tested: {total_combinations}")
-                print(f"Flights found: {len(all_results)}")
-                print(f"Returning all {len(all_results)} results to frontend")
-            
-            # Send completion update
-            send_progress_update(
-                current=total_combinations,
-                total=total_combinations,
-                current_dates="Search completed!",
-                status="completed",
-                flights_found=len(all_results),
-                job_id=job_id
-            )
+                    return self._search_range_combination(
+                        config, passengers, max_stops, dep_date, ret_date, days, job_ctx
+                    ), None
+                except Exception as e:
+                    return [], e
             
-            return {
-                'success': True,
-                'flights': all_results,  # Return ALL results to frontend
-                'total_found': len(all_results),
-                'total_combinations_tested': total_combinations,
-                'search_type': 'date_range'
+            best_flights = self._range_results(config)
+            verified = 0
+            for step, (candidate, (flights, error)) in enumerate(
+                    zip(to_verify, map_in_order(verify, to_verify)), start=len(legs) + 1):
+                _, dep_date, ret_date, days = candidate
+                if isinstance(error, JobBudgetExceeded):
+                    continue
+                if error is not None:
+                    job_ctx.note_failure(f"{dep_date} -> {ret_date}", error)
+                verified += 1
+                best_flights.add_all(flights)
+                send_progress_update(
+                    current=step,
+                    total=total_steps,
+                    current_dates=f"{dep_date} -> {ret_date} ({days} days)",
+                    status="found_flights" if flights else "searching",
+                    flights_found=best_flights.seen,
+                    job_id=job_id
+                )
+            
+            job_ctx.note_coverage(verified, len(to_verify))
+            result = self._complete_date_range(best_flights, verified, job_id, job_ctx)
+            result['sampling'] = {
+                'mode': 'one-way',
+                'one_way_queries': len(legs),
+                'round_trips_composed': len(candidates),
+                'round_trips_verified': verified,
+                'phases': {
+                    'one_way': {'upstream_calls': one_way_calls},
+                    'verify': {'upstream_calls': job_ctx.upstream_calls - one_way_calls}
+                }
             }
+            return result
             
         except Exception as e:
             return {
@@ -478,6 +2270,152 @@ class FlightSearchEngine:
                 'total_found': 0,
                 'search_type': 'date_range'
             }
+
+    def _range_worker_count(self, config):
+        """Number of concurrent workers to use for a date range search"""
+        try:
+            workers = int(config.get('concurrent_workers') or RANGE_SEARCH_WORKERS)
+        except (TypeError, ValueError):
+            workers = RANGE_SEARCH_WORKERS
+        return max(1, min(workers, MAX_RANGE_SEARCH_WORKERS))
+
+    def _search_range_combination(self, config, passengers, max_stops, dep_date, ret_date, days, job_ctx=None):
+        """Query one (departure, return) pair and return its top flights"""
+        if job_ctx is not None and job_ctx.out_of_budget():
+            raise JobBudgetExceeded(job_ctx.stop_reason, job_ctx)
+        
+        flight_data = [
+            self.FlightData(
+                date=dep_date,
+                from_airport=config['from_airport'],
+                to_airport=config['to_airport'],
+                max_stops=max_stops
+            ),
+            self.FlightData(
+                date=ret_date,
+                from_airport=config['to_airport'],
+                to_airport=config['from_airport'],
+                max_stops=max_stops
+            )
+        ]
+        
+        # Convert currency for API
+        api_currency = config.get('currency', 'ILS')
+        
+        # Use get_flights_from_filter to pass currency
+        filter_data = self.TFSData.from_interface(
+            flight_data=flight_data,
+            trip="round-trip",
+            passengers=passengers,
+            seat=config['seat_class'],
+            max_stops=max_stops
+        )
+        
+        result = self._query_flights(
+            filter_data,
+            currency=api_currency,
+            mode="common",
+            job_ctx=job_ctx,
+            label=f"{dep_date} -> {ret_date}"
+        )
+        self._record_price(filter_data, api_currency, result)
+        return self._range_combination_flights(config, result, dep_date, ret_date, days)
+
+    def _range_combination_flights(self, config, result, dep_date, ret_date, days):
+        """Top flights of one (departure, return) pair's Result, as range search entries"""
+        combination_flights = []
+        if hasattr(result, 'flights') and result.flights:
+            # Process TOP 10 flights from this combination (cheapest first)
+            top_flights = result.flights[:10]  # Take only top 10 cheapest
+            for flight_idx, flight in enumerate(top_flights):
+                # Generate booking URL
+                booking_url = self.generate_booking_url(config['from_airport'], 
+                                                      config['to_airport'], 
+                                                      dep_date, ret_date,
+                                                      config.get('adults', 1),
+                                                      config['seat_class'],
+                                                      config.get('currency', 'ILS'))
+                
+                # Parse flight details for round-trip
+                flight_details = self.parse_round_trip_details(flight, dep_date, ret_date)
+                
+                flight_info = {
+                    'departure_date': dep_date,
+                    'return_date': ret_date,
+                    'vacation_days': days,
+                    'airline': getattr(flight, 'name', 'Unknown'),
+                    'price': getattr(flight, 'price', 'N/A'),
+                    'duration': getattr(flight, 'duration', 'N/A'),
+                    'stops': getattr(flight, 'stops', 'N/A'),
+                    'departure': getattr(flight, 'departure', 'N/A'),
+                    'arrival': getattr(flight, 'arrival', 'N/A'),
+                    'is_best': getattr(flight, 'is_best', False),
+                    'price_level': getattr(result, 'current_price', 'typical'),
+                    'booking_url': booking_url,
+                    'combination_rank': flight_idx + 1,  # Rank within this combination
+                    'total_options_in_combination': len(result.flights),
+                    'outbound_details': flight_details['outbound'],
+                    'return_details': flight_details['return']
+                }
+                combination_flights.append(flight_info)
+        
+        return combination_flights
+
+    def _range_plan_collector(self, config, combinations, job_id=None, job_ctx=None, best_flights=None):
+        """on_fetched callback for execute_plan that adds each fetched combination to best_flights.
+
+        Progress is reported as queries finish, so the counter stays
+        monotonic. Flights are ordered by combination index on ties, giving
+        the same output whether the plan ran serially or concurrently.
+        Returns (on_fetched, counts); counts['searched'] excludes combinations
+        skipped by the job budget.
+        """
+        total_combinations = len(combinations)
+        counts = {'completed': 0, 'searched': 0}
+        
+        def on_fetched(query, error):
+            # Take the Result off the job memo, so the job only holds its top-K flights
+            result = job_ctx.pop_planned(query['key'])
+            for idx in query['combinations']:
+                dep_date, ret_date, days = combinations[idx]
+                counts['completed'] += 1
+                if isinstance(error, JobBudgetExceeded):
+                    # Combinations queued after the budget ran out are skipped without a call
+                    continue
+                
+                counts['searched'] += 1
+                combination_flights = []
+                if error is None:
+                    try:
+                        combination_flights = self._range_combination_flights(
+                            config, result, dep_date, ret_date, days
+                        )
+                    except Exception as e:
+                        error = e
+                
+                if error is None:
+                    best_flights.add_all(combination_flights, order=idx)
+                    status = "found_flights" if combination_flights else "searching"
+                    if combination_flights and os.environ.get('PORT') is None:
+                        total_options = combination_flights[0]['total_options_in_combination']
+                        print(f"  [OK] {dep_date} -> {ret_date}: found {total_options} flights, "
+                              f"took top {len(combination_flights)}")
+                else:
+                    job_ctx.note_failure(f"{dep_date} -> {ret_date}", error)
+                    if os.environ.get('PORT') is None:
+                        print(f"  [ERROR] {dep_date} -> {ret_date}: {error}")
+                    status = "error"
+                
+                send_progress_update(
+                    current=counts['completed'],
+                    total=total_combinations,
+                    current_dates=f"{dep_date} -> {ret_date} ({days} days)",
+                    status=status,
+                    flights_found=best_flights.seen,
+                    job_id=job_id
+                )
+        
+        return on_fetched, counts
     
     def parse_round_trip_details(self, flight, dep_date, ret_date):
         """Parse round-trip flight details into outbound and return segments"""
@@ -805,10 +2743,14 @@ class FlightSearchEngine:
                 max_stops=max_stops
             )
             
-            result = self.get_flights_from_filter(
+            job_ctx = SearchJobContext(job_id, config)
+            result = self._query_flights(
                 filter_data,
                 currency=api_currency,
-                mode="common"
+                mode="common",
+                job_ctx=job_ctx,
+                label=f"{config['departure_date']} -> {config.get('return_date') or 'one-way'}",
+                allow_stale=True
             )
             
             flights = []
@@ -844,7 +2786,10 @@ class FlightSearchEngine:
                 'flights': flights,
                 'price_level': price_level,
                 'total_found': len(flights),
-                'search_type': 'regular'
+                'search_type': 'regular',
+                'stale': job_ctx.stale_age is not None,
+                'data_age_seconds': round(job_ctx.stale_age) if job_ctx.stale_age is not None else 0,
+                **job_ctx.fetch_report()
             }
             
         except Exception as e:
@@ -857,16 +2802,220 @@ class FlightSearchEngine:
                 'search_type': 'regular'
             }
 
-    def search_multi_city(self, config, job_id=None):
-        """Dispatch multi-city search based on the requested mode."""
+    def search_multi_city(self, config, job_id=None, job_ctx=None):
+        """Dispatch multi-city search based on the requested mode.
+
+        Unless the caller already did (the async engine), every leg of the
+        search's query plan is fetched first, in plan order, so each mode
+        below combines legs from job_ctx.
+        """
+        if job_ctx is None:
+            job_ctx = SearchJobContext(job_id, config)
+            try:
+                plan = self.plan_search('multi_city', config)
+            except Exception:
+                plan = None  # Invalid config - the search below reports it
+            if plan:
+                workers = self._range_worker_count(config)
+                print(f"Fetching {len(plan)} multi-city legs on {workers} worker(s)")
+                send_progress_update(
+                    current=0,
+                    total=0,
+                    current_dates=f"Fetching {len(plan)} flight legs...",
+                    status="preparing",
+                    flights_found=0,
+                    job_id=job_id
+                )
+                self.execute_plan(plan, job_ctx, workers, on_fetched=self._leg_progress(plan, job_id))
+
+        mode = self._multi_city_mode(config)
+        if mode == 'multi-city-legs':
+            return self._search_multi_city_legs(config, job_id=job_id, job_ctx=job_ctx)
+        if mode == 'multi-city-open-jaw':
+            return self._search_multi_city_open_jaw(config, job_id=job_id, job_ctx=job_ctx)
+        if mode == 'multi-city-range':
+            return self._search_multi_city_range(config, job_id=job_id, job_ctx=job_ctx)
+        return self._search_multi_city_specific(config, job_id=job_id, job_ctx=job_ctx)
+
+    def _leg_progress(self, plan, job_id):
+        """on_fetched callback reporting each fetched leg of a multi-city plan"""
+        fetched = itertools.count(1)
+
+        def on_fetched(query, error):
+            send_progress_update(
+                current=next(fetched),
+                total=len(plan),
+                current_dates=f"Fetched {query['label']}",
+                status="preparing",
+                flights_found=0,
+                job_id=job_id
+            )
+
+        return on_fetched
+
+    def _multi_city_mode(self, config):
+        """Resolve which multi-city search a config maps to"""
         mode = config.get('multi_city_mode', 'multi-city-range')
+        if mode == 'multi-city-legs' or config.get('legs'):
+            return 'multi-city-legs'
         if mode == 'multi-city-open-jaw':
-            return self._search_multi_city_open_jaw(config, job_id=job_id)
+            return mode
         if mode == 'multi-city-range' or (config.get('start_period') and config.get('end_period')):
-            return self._search_multi_city_range(config, job_id=job_id)
-        return self._search_multi_city_specific(config, job_id=job_id)
+            return 'multi-city-range'
+        return 'multi-city-specific'
+
+    def _multi_city_fetch_params(self, config):
+        """Passengers, seat class, max stops and API currency used for every leg"""
+        max_stops = int(config.get('max_stops', -1))
+        if max_stops == -1:
+            max_stops = 2
+
+        passengers = self.Passengers(
+            adults=int(config.get('adults', 1)),
+            children=int(config.get('children', 0)),
+        )
+
+        api_currency_map = {
+            'ILS': 'ILS',
+            'USD': 'USD',
+            'EUR': 'EUR',
+            'GBP': 'GBP'
+        }
+        api_currency = api_currency_map.get(config.get('currency', 'ILS'), 'ILS')
+
+        return passengers, config.get('seat_class', 'economy'), max_stops, api_currency
+
+    def _multi_city_leg_specs(self, config):
+        """Parse and validate the legs list of an N-leg multi-city search.
+
+        Each leg has from, to, an earliest and latest departure date and the
+        min_stay/max_stay days spent at its destination before the next leg.
+        """
+        from datetime import datetime
+
+        legs = config.get('legs')
+        if isinstance(legs, str):
+            legs = json.loads(legs)
+        if not isinstance(legs, list) or len(legs) < 2:
+            raise ValueError('A multi-leg search needs at least two legs')
+
+        specs = []
+        for number, leg in enumerate(legs, start=1):
+            try:
+                origin = str(leg['from']).strip().upper()
+                destination = str(leg['to']).strip().upper()
+                earliest = datetime.strptime(leg.get('earliest') or leg['date'], '%Y-%m-%d')
+                latest = datetime.strptime(leg.get('latest') or leg.get('earliest') or leg['date'], '%Y-%m-%d')
+                min_stay = int(leg.get('min_stay', 1))
+                max_stay = int(leg.get('max_stay', min_stay))
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f'Invalid leg {number}: {e}')
+
+            if not origin or not destination:
+                raise ValueError(f'Leg {number} needs both from and to airports')
+            if latest < earliest:
+                raise ValueError(f'Leg {number} latest date is before its earliest date')
+            if min_stay < 0 or max_stay < min_stay:
+                raise ValueError(f'Leg {number} stay must satisfy 0 <= min_stay <= max_stay')
+
+            specs.append({
+                'from': origin,
+                'to': destination,
+                'earliest': earliest,
+                'latest': latest,
+                'min_stay': min_stay,
+                'max_stay': max_stay
+            })
+
+        return specs
+
+    def _multi_city_leg_dates(self, specs):
+        """Departure dates of each leg that fit its window and can chain with the legs around it"""
+        from datetime import timedelta
+
+        def window(spec):
+            days = (spec['latest'] - spec['earliest']).days
+            return [spec['earliest'] + timedelta(days=offset) for offset in range(days + 1)]
 
-    def _search_multi_city_specific(self, config, job_id=None):
+        def chains(previous_spec, previous_date, next_date):
+            stay = (next_date - previous_date).days
+            return previous_spec['min_stay'] <= stay <= previous_spec['max_stay']
+
+        dates = [window(specs[0])]
+        for index in range(1, len(specs)):
+            dates.append([
+                date for date in window(specs[index])
+                if any(chains(specs[index - 1], previous, date) for previous in dates[-1])
+            ])
+
+        # Drop dates no later leg can follow
+        for index in range(len(specs) - 2, -1, -1):
+            dates[index] = [
+                date for date in dates[index]
+                if any(chains(specs[index], date, following) for following in dates[index + 1])
+            ]
+
+        return dates
+
+    def _multi_city_legs(self, config):
+        """Distinct (origin, destination, date) legs a multi-city search needs, and its number of date combinations"""
+        legs = []
+        seen = set()
+
+        def add(origin, destination, date_value):
+            date_str = date_value if isinstance(date_value, str) else date_value.strftime('%Y-%m-%d')
+            leg = (origin, destination, date_str)
+            if leg not in seen:
+                seen.add(leg)
+                legs.append(leg)
+
+        mode = self._multi_city_mode(config)
+
+        if mode == 'multi-city-legs':
+            specs = self._multi_city_leg_specs(config)
+            leg_dates = self._multi_city_leg_dates(specs)
+            for spec, dates in zip(specs, leg_dates):
+                for leg_date in dates:
+                    add(spec['from'], spec['to'], leg_date)
+
+            # Count the feasible date sequences leg by leg
+            paths = {leg_date: 1 for leg_date in leg_dates[0]}
+            for index in range(1, len(specs)):
+                previous_spec = specs[index - 1]
+                paths = {
+                    leg_date: sum(
+                        count for previous_date, count in paths.items()
+                        if previous_spec['min_stay'] <= (leg_date - previous_date).days <= previous_spec['max_stay']
+                    )
+                    for leg_date in leg_dates[index]
+                }
+            return legs, sum(paths.values())
+
+        if mode == 'multi-city-specific':
+            leg2_dates = self._multi_city_specific_leg2_dates(config)
+            add(config['leg1_from'], config['leg1_to'], config['leg1_date'])
+            for leg2_date in leg2_dates:
+                add(config['leg2_from'], config['leg2_to'], leg2_date)
+            add(config['leg3_from'], config['leg3_to'], config['leg3_date'])
+            return legs, len(leg2_dates)
+
+        if mode == 'multi-city-open-jaw':
+            combinations = self._multi_city_open_jaw_combinations(config)
+            for combo in combinations:
+                add(config['leg1_from'], config['leg1_to'], combo['start'])
+                add(config['leg3_from'], config['leg3_to'], combo['return'])
+            return legs, len(combinations)
+
+        combinations = 0
+        for combo in self._multi_city_range_combinations(config):
+            add(config['leg1_from'], config['leg1_to'], combo['start'])
+            for _, mid_date in combo['mid_options']:
+                add(config['leg2_from'], config['leg2_to'], mid_date)
+            add(config['leg3_from'], config['leg3_to'], combo['return'])
+            combinations += len(combo['mid_options'])
+        return legs, combinations
+
+    def _search_multi_city_specific(self, config, job_id=None, job_ctx=None):
         """Handle multi-city search when exact dates are provided."""
         from datetime import datetime
 
@@ -897,6 +3046,7 @@ class FlightSearchEngine:
                 adults=adults,
                 children=children,
             )
+            job_ctx = job_ctx or SearchJobContext(job_id, config)
             
             api_currency_map = {
                 'ILS': 'ILS',
@@ -932,12 +3082,10 @@ class FlightSearchEngine:
                     'search_type': 'multi_city'
                 }
 
-            all_combinations = []
-            base_leg2_date = datetime.strptime(leg2_date, '%Y-%m-%d')
-            leg2_dates = [
-                (base_leg2_date + timedelta(days=offset)).strftime('%Y-%m-%d')
-                for offset in range(-leg2_flexibility, leg2_flexibility + 1)
-            ]
+            best_combinations = TopKAggregator(result_limit(config))
+            beam_width = combination_beam_width(config)
+            limits = combination_limits(config)
+            leg2_dates = self._multi_city_specific_leg2_dates(config)
             
             total_combinations = len(leg2_dates)
 
@@ -969,7 +3117,7 @@ class FlightSearchEngine:
                         total=total_combinations,
                         current_dates=combination_label,
                         status="searching",
-                        flights_found=len(all_combinations),
+                        flights_found=best_combinations.seen,
                         job_id=job_id
                     )
 
@@ -980,7 +3128,8 @@ class FlightSearchEngine:
                         passengers,
                         seat_class,
                         max_stops,
-                        api_currency
+                        api_currency,
+                        job_ctx=job_ctx
                     )
 
                     if not leg1_flights:
@@ -993,7 +3142,8 @@ class FlightSearchEngine:
                         passengers,
                         seat_class,
                         max_stops,
-                        api_currency
+                        api_currency,
+                        job_ctx=job_ctx
                     )
 
                     if not leg2_flights:
@@ -1006,78 +3156,77 @@ class FlightSearchEngine:
                         passengers,
                         seat_class,
                         max_stops,
-                        api_currency
+                        api_currency,
+                        job_ctx=job_ctx
                     )
 
                     if not leg3_flights:
                         continue
 
-                    for leg1_flight in leg1_flights[:5]:
-                        for leg2_flight in leg2_flights[:5]:
-                            for leg3_flight in leg3_flights[:5]:
-                                price1 = self._parse_price_value(getattr(leg1_flight, 'price', None))
-                                price2 = self._parse_price_value(getattr(leg2_flight, 'price', None))
-                                price3 = self._parse_price_value(getattr(leg3_flight, 'price', None))
-
-                                if any(price is None for price in (price1, price2, price3)):
-                                    continue
-
-                                combination = {
-                                    'total_price': price1 + price2 + price3,
-                                    'currency_symbol': currency_symbol,
-                                    'leg1': self._build_leg_details(leg1_from, leg1_to, leg1_date, leg1_flight, price1),
-                                    'leg2': self._build_leg_details(leg2_from, leg2_to, leg2_date_option, leg2_flight, price2),
-                                    'leg3': self._build_leg_details(leg3_from, leg3_to, leg3_date, leg3_flight, price3),
-                                    'trip_summary': {
-                                        'start_date': leg1_date,
-                                        'mid_date': leg2_date_option,
-                                        'return_date': leg3_date
-                                    }
-                                }
-                                all_combinations.append(combination)
+                    def build_combination(prices, flights):
+                        return {
+                            'total_price': sum(prices),
+                            'currency_symbol': currency_symbol,
+                            'leg1': self._build_leg_details(leg1_from, leg1_to, leg1_date, flights[0], prices[0]),
+                            'leg2': self._build_leg_details(leg2_from, leg2_to, leg2_date_option, flights[1], prices[1]),
+                            'leg3': self._build_leg_details(leg3_from, leg3_to, leg3_date, flights[2], prices[2]),
+                            'trip_summary': {
+                                'start_date': leg1_date,
+                                'mid_date': leg2_date_option,
+                                'return_date': leg3_date
+                            }
+                        }
 
-                        if all_combinations:
-                            send_progress_update(
-                                current=idx + 1,
-                                total=total_combinations,
-                                current_dates=combination_label,
-                                status="found_flights",
-                                flights_found=len(all_combinations),
-                                job_id=job_id
-                            )
+                    self._add_best_combinations(
+                        best_combinations, [leg1_flights, leg2_flights, leg3_flights], build_combination, beam_width,
+                        job_ctx=job_ctx, **limits
+                    )
+
+                    if best_combinations.seen:
+                        send_progress_update(
+                            current=idx + 1,
+                            total=total_combinations,
+                            current_dates=combination_label,
+                            status="found_flights",
+                            flights_found=best_combinations.seen,
+                            job_id=job_id
+                        )
 
                 except Exception as e:
+                    job_ctx.note_failure(f"{leg1_date} -> {leg2_date_option} -> {leg3_date}", e)
                     print(f"   Error processing leg 2 date {leg2_date_option}: {e}")
                     send_progress_update(
                         current=idx + 1,
                         total=total_combinations,
                         current_dates=f"{leg1_date} -> {leg2_date_option} -> {leg3_date}",
                         status="error",
-                        flights_found=len(all_combinations),
+                        flights_found=best_combinations.seen,
                         job_id=job_id
                     )
                     continue
 
-            all_combinations.sort(key=lambda x: x['total_price'])
+            best_flights = best_combinations.best()
 
-            print(f"[OK] Found {len(all_combinations)} multi-city combinations (specific dates)")
+            print(f"[OK] Found {best_combinations.seen} multi-city combinations (specific dates)")
 
             send_progress_update(
                 current=total_combinations,
                 total=total_combinations,
                 current_dates="Search completed!",
                 status="completed",
-                flights_found=len(all_combinations),
+                flights_found=best_combinations.seen,
                 job_id=job_id
             )
 
             return {
                 'success': True,
-                'flights': all_combinations,
-                'total_found': len(all_combinations),
+                'flights': best_flights,
+                'total_found': best_combinations.seen,
                 'total_combinations_tested': total_combinations,
+                'unique_legs_fetched': job_ctx.legs_fetched(),
                 'search_type': 'multi_city',
-                'currency': currency
+                'currency': currency,
+                **job_ctx.fetch_report()
             }
 
         except Exception as e:
@@ -1090,7 +3239,7 @@ class FlightSearchEngine:
                 'search_type': 'multi_city'
             }
 
-    def _search_multi_city_range(self, config, job_id=None):
+    def _search_multi_city_range(self, config, job_id=None, job_ctx=None):
         """Handle multi-city search over a date range with flexible mid-point."""
         from datetime import datetime, timedelta
 
@@ -1115,6 +3264,7 @@ class FlightSearchEngine:
                 adults=adults,
                 children=children,
             )
+            job_ctx = job_ctx or SearchJobContext(job_id, config)
 
             start_period = config.get('start_period')
             end_period = config.get('end_period')
@@ -1166,33 +3316,14 @@ class FlightSearchEngine:
             print(f"   Trip length: {min_days}-{max_days} days")
             print(f"   Mid-trip target day: {leg2_target_day} +/- {leg2_flexibility}")
 
-            combinations_to_test = []
-            current_date = start_date
-            while current_date <= end_date:
-                for total_days in range(min_days, max_days + 1):
-                    return_date = current_date + timedelta(days=total_days)
-                    if return_date > end_date:
-                        continue
-                        
-                    mid_options = []
-                    for offset in range(-leg2_flexibility, leg2_flexibility + 1):
-                        mid_day = leg2_target_day + offset
-                        if mid_day < 2 or mid_day >= total_days:
-                            continue
-                        mid_date = current_date + timedelta(days=mid_day - 1)
-                        if mid_date >= return_date:
-                            continue
-                        mid_options.append((mid_day, mid_date))
-
-                    if mid_options:
-                        combinations_to_test.append({
-                            'start': current_date,
-                            'return': return_date,
-                            'total_days': total_days,
-                            'mid_options': mid_options
-                        })
+            combinations_to_test = self._multi_city_range_combinations(config)
 
-                current_date += timedelta(days=1)
+            if combination_order(config) == 'price':
+                self._order_multi_city_by_likely_price(
+                    combinations_to_test,
+                    [(leg1_from, leg1_to), (leg2_from, leg2_to), (leg3_from, leg3_to)],
+                    passengers, seat_class, max_stops, api_currency
+                )
 
             total_combinations = sum(len(item['mid_options']) for item in combinations_to_test)
 
@@ -1225,7 +3356,9 @@ class FlightSearchEngine:
 
             print(f"   Total combinations to test: {total_combinations}")
 
-            all_combinations = []
+            best_combinations = TopKAggregator(result_limit(config))
+            beam_width = combination_beam_width(config)
+            limits = combination_limits(config)
             processed = 0
 
             for combo in combinations_to_test:
@@ -1248,7 +3381,7 @@ class FlightSearchEngine:
                         total=total_combinations,
                         current_dates=combination_label,
                         status="searching",
-                        flights_found=len(all_combinations),
+                        flights_found=best_combinations.seen,
                         job_id=job_id
                     )
 
@@ -1260,7 +3393,8 @@ class FlightSearchEngine:
                             passengers,
                             seat_class,
                             max_stops,
-                            api_currency
+                            api_currency,
+                            job_ctx=job_ctx
                         )
 
                         if not leg1_flights:
@@ -1273,7 +3407,8 @@ class FlightSearchEngine:
                             passengers,
                             seat_class,
                             max_stops,
-                            api_currency
+                            api_currency,
+                            job_ctx=job_ctx
                         )
 
                         if not leg2_flights:
@@ -1286,80 +3421,79 @@ class FlightSearchEngine:
                             passengers,
                             seat_class,
                             max_stops,
-                            api_currency
+                            api_currency,
+                            job_ctx=job_ctx
                         )
 
                         if not leg3_flights:
                             continue
 
-                        for leg1_flight in leg1_flights[:5]:
-                            for leg2_flight in leg2_flights[:5]:
-                                for leg3_flight in leg3_flights[:5]:
-                                    price1 = self._parse_price_value(getattr(leg1_flight, 'price', None))
-                                    price2 = self._parse_price_value(getattr(leg2_flight, 'price', None))
-                                    price3 = self._parse_price_value(getattr(leg3_flight, 'price', None))
-
-                                    if any(price is None for price in (price1, price2, price3)):
-                                        continue
-
-                                    combination = {
-                                        'total_price': price1 + price2 + price3,
-                                        'currency_symbol': currency_symbol,
-                                        'leg1': self._build_leg_details(leg1_from, leg1_to, leg1_date, leg1_flight, price1),
-                                        'leg2': self._build_leg_details(leg2_from, leg2_to, leg2_date, leg2_flight, price2),
-                                        'leg3': self._build_leg_details(leg3_from, leg3_to, leg3_date, leg3_flight, price3),
-                                        'trip_summary': {
-                                            'start_date': leg1_date,
-                                            'mid_date': leg2_date,
-                                            'return_date': leg3_date,
-                                            'total_days': combo['total_days'],
-                                            'mid_trip_day': mid_day
-                                        }
-                                    }
-                                    all_combinations.append(combination)
-
-                        if all_combinations:
+                        def build_combination(prices, flights):
+                            return {
+                                'total_price': sum(prices),
+                                'currency_symbol': currency_symbol,
+                                'leg1': self._build_leg_details(leg1_from, leg1_to, leg1_date, flights[0], prices[0]),
+                                'leg2': self._build_leg_details(leg2_from, leg2_to, leg2_date, flights[1], prices[1]),
+                                'leg3': self._build_leg_details(leg3_from, leg3_to, leg3_date, flights[2], prices[2]),
+                                'trip_summary': {
+                                    'start_date': leg1_date,
+                                    'mid_date': leg2_date,
+                                    'return_date': leg3_date,
+                                    'total_days': combo['total_days'],
+                                    'mid_trip_day': mid_day
+                                }
+                            }
+
+                        self._add_best_combinations(
+                            best_combinations, [leg1_flights, leg2_flights, leg3_flights], build_combination, beam_width,
+                            job_ctx=job_ctx, **limits
+                        )
+
+                        if best_combinations.seen:
                             send_progress_update(
                                 current=processed,
                                 total=total_combinations,
                                 current_dates=combination_label,
                                 status="found_flights",
-                                flights_found=len(all_combinations),
+                                flights_found=best_combinations.seen,
                                 job_id=job_id
                             )
 
                     except Exception as leg_error:
+                        job_ctx.note_failure(combination_label, leg_error)
                         print(f"   Error computing combination: {leg_error}")
                         send_progress_update(
                             current=processed,
                             total=total_combinations,
                             current_dates=combination_label,
                             status="error",
-                            flights_found=len(all_combinations),
+                            flights_found=best_combinations.seen,
                             job_id=job_id
                         )
                         continue
             
-            all_combinations.sort(key=lambda x: x['total_price'])
+            best_flights = best_combinations.best()
             
-            print(f"[OK] Found {len(all_combinations)} multi-city combinations (range mode)")
+            print(f"[OK] Found {best_combinations.seen} multi-city combinations (range mode)")
             
             send_progress_update(
                 current=total_combinations,
                 total=total_combinations,
                 current_dates="Search completed!",
                 status="completed",
-                flights_found=len(all_combinations),
+                flights_found=best_combinations.seen,
                 job_id=job_id
             )
             
             return {
                 'success': True,
-                'flights': all_combinations,
-                'total_found': len(all_combinations),
+                'flights': best_flights,
+                'total_found': best_combinations.seen,
                 'total_combinations_tested': total_combinations,
+                'unique_legs_fetched': job_ctx.legs_fetched(),
                 'search_type': 'multi_city',
-                'currency': currency
+                'currency': currency,
+                **job_ctx.fetch_report()
             }
             
         except Exception as e:
@@ -1372,7 +3506,99 @@ class FlightSearchEngine:
                 'search_type': 'multi_city'
             }
 
-    def _search_multi_city_open_jaw(self, config, job_id=None):
+    def _multi_city_range_combinations(self, config):
+        """Start, return, trip length and (day, date) mid-trip options of each multi-city range combination"""
+        start_date = datetime.strptime(config['start_period'], '%Y-%m-%d')
+        end_date = datetime.strptime(config['end_period'], '%Y-%m-%d')
+        min_days = max(3, int(config.get('min_vacation_days', 7)))
+        max_days = max(min_days, int(config.get('max_vacation_days', min_days)))
+        leg2_target_day = max(2, int(config.get('leg2_target_day', 8)))
+        leg2_flexibility = max(0, int(config.get('leg2_flexibility', 1)))
+
+        combinations = []
+        current_date = start_date
+        while current_date <= end_date:
+            for total_days in range(min_days, max_days + 1):
+                return_date = current_date + timedelta(days=total_days)
+                if return_date > end_date:
+                    continue
+
+                mid_options = []
+                for offset in range(-leg2_flexibility, leg2_flexibility + 1):
+                    mid_day = leg2_target_day + offset
+                    if mid_day < 2 or mid_day >= total_days:
+                        continue
+                    mid_date = current_date + timedelta(days=mid_day - 1)
+                    if mid_date >= return_date:
+                        continue
+                    mid_options.append((mid_day, mid_date))
+
+                if mid_options:
+                    combinations.append({
+                        'start': current_date,
+                        'return': return_date,
+                        'total_days': total_days,
+                        'mid_options': mid_options
+                    })
+
+            current_date += timedelta(days=1)
+
+        return combinations
+
+    def _multi_city_specific_leg2_dates(self, config):
+        """Flexible middle-leg dates of a specific-dates multi-city search"""
+        leg2_flexibility = int(config.get('leg2_flexibility', 1))
+        base_leg2_date = datetime.strptime(config['leg2_date'], '%Y-%m-%d')
+        return [
+            (base_leg2_date + timedelta(days=offset)).strftime('%Y-%m-%d')
+            for offset in range(-leg2_flexibility, leg2_flexibility + 1)
+        ]
+
+    def _multi_city_open_jaw_combinations(self, config):
+        """Start, return and trip length of each open-jaw combination"""
+        start_date = datetime.strptime(config['start_period'], '%Y-%m-%d')
+        end_date = datetime.strptime(config['end_period'], '%Y-%m-%d')
+        min_days = max(2, int(config.get('min_vacation_days', 7)))
+        max_days = max(min_days, int(config.get('max_vacation_days', min_days)))
+
+        combinations = []
+        current_date = start_date
+        while current_date <= end_date:
+            for total_days in range(min_days, max_days + 1):
+                return_date = current_date + timedelta(days=total_days)
+                if return_date > end_date:
+                    continue
+                combinations.append({
+                    'start': current_date,
+                    'return': return_date,
+                    'total_days': total_days
+                })
+            current_date += timedelta(days=1)
+
+        return combinations
+
+    def _order_multi_city_by_likely_price(self, combinations, routes, passengers, seat_class, max_stops, api_currency):
+        """Sort range combinations, and the mid-trip options of each, likely-cheapest first"""
+        leg_prices = {}
+
+        def leg_price(route, leg_date):
+            origin, destination = route
+            date_str = leg_date.strftime('%Y-%m-%d')
+            if (route, date_str) not in leg_prices:
+                filter_data = self._one_way_filter(origin, destination, date_str, passengers, seat_class, max_stops)
+                leg_prices[(route, date_str)] = self._likely_price(filter_data, api_currency)
+            return leg_prices[(route, date_str)]
+
+        outbound, mid, inbound = routes
+        likely = {}
+        for index, combo in enumerate(combinations):
+            combo['mid_options'].sort(key=lambda option: leg_price(mid, option[1]))
+            likely[index] = (leg_price(outbound, combo['start']) + leg_price(mid, combo['mid_options'][0][1])
+                             + leg_price(inbound, combo['return']))
+        order = sorted(range(len(combinations)), key=lambda index: likely[index])
+        combinations[:] = [combinations[index] for index in order]
+
+    def _search_multi_city_open_jaw(self, config, job_id=None, job_ctx=None):
         """Handle open-jaw (two-leg) multi-city search."""
         from datetime import datetime, timedelta
 
@@ -1395,6 +3621,7 @@ class FlightSearchEngine:
                 adults=adults,
                 children=children,
             )
+            job_ctx = job_ctx or SearchJobContext(job_id, config)
 
             start_period = config.get('start_period')
             end_period = config.get('end_period')
@@ -1443,20 +3670,7 @@ class FlightSearchEngine:
             print(f"   Start period: {start_period} -> {end_period}")
             print(f"   Trip length: {min_days}-{max_days} days")
 
-            combinations_to_test = []
-            current_date = start_date
-
-            while current_date <= end_date:
-                for total_days in range(min_days, max_days + 1):
-                    return_date = current_date + timedelta(days=total_days)
-                    if return_date > end_date:
-                        continue
-                    combinations_to_test.append({
-                        'start': current_date,
-                        'return': return_date,
-                        'total_days': total_days
-                    })
-                current_date += timedelta(days=1)
+            combinations_to_test = self._multi_city_open_jaw_combinations(config)
 
             total_combinations = len(combinations_to_test)
 
@@ -1489,7 +3703,9 @@ class FlightSearchEngine:
 
             print(f"   Total combinations to test: {total_combinations}")
 
-            all_combinations = []
+            best_combinations = TopKAggregator(result_limit(config))
+            beam_width = combination_beam_width(config)
+            limits = combination_limits(config)
 
             for idx, combo in enumerate(combinations_to_test, start=1):
                 leg1_date = combo['start'].strftime('%Y-%m-%d')
@@ -1501,104 +3717,297 @@ class FlightSearchEngine:
                     total=total_combinations,
                     current_dates=combination_label,
                     status="searching",
-                    flights_found=len(all_combinations),
+                    flights_found=best_combinations.seen,
+                    job_id=job_id
+                )
+
+                try:
+                    leg1_flights = self._fetch_one_way_flights(
+                        leg1_from,
+                        leg1_to,
+                        leg1_date,
+                        passengers,
+                        seat_class,
+                        max_stops,
+                        api_currency,
+                        job_ctx=job_ctx
+                    )
+
+                    if not leg1_flights:
+                        continue
+
+                    leg2_flights = self._fetch_one_way_flights(
+                        leg2_from,
+                        leg2_to,
+                        leg2_date,
+                        passengers,
+                        seat_class,
+                        max_stops,
+                        api_currency,
+                        job_ctx=job_ctx
+                    )
+
+                    if not leg2_flights:
+                        continue
+
+                    def build_combination(prices, flights):
+                        return {
+                            'total_price': sum(prices),
+                            'currency_symbol': currency_symbol,
+                            'leg1': self._build_leg_details(leg1_from, leg1_to, leg1_date, flights[0], prices[0]),
+                            'leg2': self._build_leg_details(leg2_from, leg2_to, leg2_date, flights[1], prices[1]),
+                            'trip_summary': {
+                                'start_date': leg1_date,
+                                'return_date': leg2_date,
+                                'total_days': combo['total_days']
+                            }
+                        }
+
+                    self._add_best_combinations(
+                        best_combinations, [leg1_flights, leg2_flights], build_combination, beam_width,
+                        job_ctx=job_ctx, **limits
+                    )
+
+                    if best_combinations.seen:
+                        send_progress_update(
+                            current=idx,
+                            total=total_combinations,
+                            current_dates=combination_label,
+                            status="found_flights",
+                            flights_found=best_combinations.seen,
+                            job_id=job_id
+                        )
+
+                except Exception as combo_error:
+                    job_ctx.note_failure(combination_label, combo_error)
+                    print(f"   Error computing open-jaw combination {combination_label}: {combo_error}")
+                    send_progress_update(
+                        current=idx,
+                        total=total_combinations,
+                        current_dates=combination_label,
+                        status="error",
+                        flights_found=best_combinations.seen,
+                        job_id=job_id
+                    )
+                    continue
+
+            best_flights = best_combinations.best()
+
+            print(f"[OK] Found {best_combinations.seen} open-jaw combinations")
+
+            send_progress_update(
+                current=total_combinations,
+                total=total_combinations,
+                current_dates="Search completed!",
+                status="completed",
+                flights_found=best_combinations.seen,
+                job_id=job_id
+            )
+
+            return {
+                'success': True,
+                'flights': best_flights,
+                'total_found': best_combinations.seen,
+                'total_combinations_tested': total_combinations,
+                'unique_legs_fetched': job_ctx.legs_fetched(),
+                'search_type': 'multi_city',
+                'currency': currency,
+                **job_ctx.fetch_report()
+            }
+
+        except Exception as e:
+            print(f"[ERROR] Open-jaw multi-city search error: {e}")
+            return {
+                'success': False,
+                'error': str(e),
+                'flights': [],
+                'total_found': 0,
+                'search_type': 'multi_city'
+            }
+
+    def _search_multi_city_legs(self, config, job_id=None, job_ctx=None):
+        """Handle multi-city search over an arbitrary list of legs.
+
+        Every feasible (leg, date) is fetched once into a price matrix, so a
+        longer trip costs linearly more upstream calls. Dynamic programming
+        over the legs then keeps the cheapest date sequences ending on each
+        date, and flights are combined only for the cheapest sequences.
+        """
+        try:
+            specs = self._multi_city_leg_specs(config)
+            leg_dates = self._multi_city_leg_dates(specs)
+            passengers, seat_class, max_stops, api_currency = self._multi_city_fetch_params(config)
+            currency = config.get('currency', 'ILS')
+            job_ctx = job_ctx or SearchJobContext(job_id, config)
+
+            currency_symbol_map = {
+                'ILS': 'ILS',
+                'USD': 'USD',
+                'EUR': 'EUR',
+                'GBP': 'GBP'
+            }
+            currency_symbol = currency_symbol_map.get(currency, currency)
+
+            route = ' -> '.join([specs[0]['from']] + [spec['to'] for spec in specs])
+            total_cells = sum(len(dates) for dates in leg_dates)
+
+            print(f"Multi-Leg Multi-City Search: {route}")
+            print(f"   {len(specs)} legs, {total_cells} leg dates to fetch")
+
+            if total_cells == 0 or not all(leg_dates):
+                send_progress_update(
+                    current=0,
+                    total=0,
+                    current_dates="No leg dates fit the stay constraints",
+                    status="completed",
+                    flights_found=0,
                     job_id=job_id
                 )
+                return {
+                    'success': True,
+                    'flights': [],
+                    'total_found': 0,
+                    'total_combinations_tested': 0,
+                    'search_type': 'multi_city',
+                    'currency': currency
+                }
 
-                try:
-                    leg1_flights = self._fetch_one_way_flights(
-                        leg1_from,
-                        leg1_to,
-                        leg1_date,
-                        passengers,
-                        seat_class,
-                        max_stops,
-                        api_currency
+            # Price matrix: per leg, date -> (cheapest price, flights)
+            matrix = [{} for _ in specs]
+            fetched = 0
+            for index, (spec, dates) in enumerate(zip(specs, leg_dates)):
+                for leg_date in dates:
+                    if job_ctx.out_of_budget():
+                        break
+                    fetched += 1
+                    date_str = leg_date.strftime('%Y-%m-%d')
+                    label = f"Leg {index + 1}: {spec['from']} -> {spec['to']} {date_str}"
+                    send_progress_update(
+                        current=fetched,
+                        total=total_cells,
+                        current_dates=label,
+                        status="searching",
+                        flights_found=0,
+                        job_id=job_id
                     )
 
-                    if not leg1_flights:
+                    try:
+                        flights = self._fetch_one_way_flights(
+                            spec['from'],
+                            spec['to'],
+                            date_str,
+                            passengers,
+                            seat_class,
+                            max_stops,
+                            api_currency,
+                            job_ctx=job_ctx
+                        )
+                    except Exception as e:
+                        job_ctx.note_failure(label, e)
                         continue
 
-                    leg2_flights = self._fetch_one_way_flights(
-                        leg2_from,
-                        leg2_to,
-                        leg2_date,
-                        passengers,
-                        seat_class,
-                        max_stops,
-                        api_currency
-                    )
+                    prices = [self._parse_price_value(getattr(flight, 'price', None)) for flight in flights]
+                    prices = [price for price in prices if price is not None]
+                    if prices:
+                        matrix[index][leg_date] = (min(prices), flights)
 
-                    if not leg2_flights:
-                        continue
+            job_ctx.note_coverage(fetched, total_cells)
 
-                    for flight_a in leg1_flights[:5]:
-                        for flight_b in leg2_flights[:5]:
-                            price_a = self._parse_price_value(getattr(flight_a, 'price', None))
-                            price_b = self._parse_price_value(getattr(flight_b, 'price', None))
+            # best[date] holds the k cheapest (price, dates) sequences whose last leg departs on date
+            best_combinations = TopKAggregator(result_limit(config))
+            beam_width = combination_beam_width(config)
+            limits = combination_limits(config)
+            keep = result_limit(config)
+            keep = keep if keep > 0 else None
 
-                            if price_a is None or price_b is None:
-                                continue
+            best = {
+                leg_date: [(price, (leg_date,))]
+                for leg_date, (price, _) in matrix[0].items()
+            }
+            for index in range(1, len(specs)):
+                previous_spec = specs[index - 1]
+                step = {}
+                for leg_date, (price, _) in matrix[index].items():
+                    candidates = [
+                        (total + price, sequence + (leg_date,))
+                        for previous_date, sequences in best.items()
+                        if previous_spec['min_stay'] <= (leg_date - previous_date).days <= previous_spec['max_stay']
+                        for total, sequence in sequences
+                    ]
+                    if candidates:
+                        step[leg_date] = heapq.nsmallest(keep, candidates) if keep else sorted(candidates)
+                best = step
 
-                            combination = {
-                                'total_price': price_a + price_b,
-                                'currency_symbol': currency_symbol,
-                                'leg1': self._build_leg_details(leg1_from, leg1_to, leg1_date, flight_a, price_a),
-                                'leg2': self._build_leg_details(leg2_from, leg2_to, leg2_date, flight_b, price_b),
-                                'trip_summary': {
-                                    'start_date': leg1_date,
-                                    'return_date': leg2_date,
-                                    'total_days': combo['total_days']
-                                }
-                            }
-                            all_combinations.append(combination)
+            itineraries = [entry for sequences in best.values() for entry in sequences]
+            itineraries = heapq.nsmallest(keep, itineraries) if keep else sorted(itineraries)
 
-                    if all_combinations:
-                        send_progress_update(
-                            current=idx,
-                            total=total_combinations,
-                            current_dates=combination_label,
-                            status="found_flights",
-                            flights_found=len(all_combinations),
-                            job_id=job_id
-                        )
+            print(f"   {len(itineraries)} feasible date itineraries")
 
-                except Exception as combo_error:
-                    print(f"   Error computing open-jaw combination {combination_label}: {combo_error}")
-                    send_progress_update(
-                        current=idx,
-                        total=total_combinations,
-                        current_dates=combination_label,
-                        status="error",
-                        flights_found=len(all_combinations),
-                        job_id=job_id
-                    )
-                    continue
+            tested = 0
+            for lower_bound, sequence in itineraries:
+                # Cheapest flight per leg is a lower bound for every combination on these dates
+                if not best_combinations.admits(lower_bound):
+                    break
+                tested += 1
+
+                date_strs = [leg_date.strftime('%Y-%m-%d') for leg_date in sequence]
+
+                def build_combination(prices, flights):
+                    legs = [
+                        self._build_leg_details(spec['from'], spec['to'], date_str, flight, price)
+                        for spec, date_str, flight, price in zip(specs, date_strs, flights, prices)
+                    ]
+                    combination = {
+                        'total_price': sum(prices),
+                        'currency_symbol': currency_symbol,
+                        'legs': legs,
+                        'trip_summary': {
+                            'start_date': date_strs[0],
+                            'return_date': date_strs[-1],
+                            'total_days': (sequence[-1] - sequence[0]).days,
+                            'dates': date_strs
+                        }
+                    }
+                    for number, leg in enumerate(legs, start=1):
+                        combination[f'leg{number}'] = leg
+                    return combination
+
+                self._add_best_combinations(
+                    best_combinations,
+                    [matrix[index][leg_date][1] for index, leg_date in enumerate(sequence)],
+                    build_combination,
+                    beam_width,
+                    job_ctx=job_ctx,
+                    **limits
+                )
 
-            all_combinations.sort(key=lambda x: x['total_price'])
+            best_flights = best_combinations.best()
 
-            print(f"[OK] Found {len(all_combinations)} open-jaw combinations")
+            print(f"[OK] Found {best_combinations.seen} multi-city combinations (multi-leg mode)")
 
             send_progress_update(
-                current=total_combinations,
-                total=total_combinations,
+                current=total_cells,
+                total=total_cells,
                 current_dates="Search completed!",
                 status="completed",
-                flights_found=len(all_combinations),
+                flights_found=best_combinations.seen,
                 job_id=job_id
             )
 
             return {
                 'success': True,
-                'flights': all_combinations,
-                'total_found': len(all_combinations),
-                'total_combinations_tested': total_combinations,
+                'flights': best_flights,
+                'total_found': best_combinations.seen,
+                'total_combinations_tested': tested,
+                'date_itineraries': len(itineraries),
+                'unique_legs_fetched': job_ctx.legs_fetched(),
                 'search_type': 'multi_city',
-                'currency': currency
+                'currency': currency,
+                **job_ctx.fetch_report()
             }
 
         except Exception as e:
-            print(f"[ERROR] Open-jaw multi-city search error: {e}")
+            print(f"[ERROR] Multi-city multi-leg search error: {e}")
             return {
                 'success': False,
                 'error': str(e),
@@ -1607,7 +4016,57 @@ class FlightSearchEngine:
                 'search_type': 'multi_city'
             }
 
-    def _fetch_one_way_flights(self, origin, destination, date_str, passengers, seat_class, max_stops, api_currency):
+    def _fetch_one_way_flights(self, origin, destination, date_str, passengers, seat_class, max_stops, api_currency, job_ctx=None):
+        if job_ctx is not None:
+            # Each (origin, destination, date) leg is fetched once per job
+            return job_ctx.get_leg(
+                (origin, destination, date_str),
+                lambda: self._query_one_way_flights(
+                    origin, destination, date_str, passengers, seat_class, max_stops, api_currency, job_ctx
+                )
+            )
+
+        return self._query_one_way_flights(
+            origin, destination, date_str, passengers, seat_class, max_stops, api_currency
+        )
+
+    def _query_one_way_flights(self, origin, destination, date_str, passengers, seat_class, max_stops, api_currency, job_ctx=None):
+        filter_data = self._one_way_filter(origin, destination, date_str, passengers, seat_class, max_stops)
+        result = self._query_flights(filter_data, currency=api_currency, mode="common",
+                                     job_ctx=job_ctx, label=f"{origin} -> {destination} {date_str}")
+        self._record_price(filter_data, api_currency, result)
+        return result.flights if hasattr(result, 'flights') and result.flights else []
+
+    def _cheapest_price(self, result):
+        """Lowest parsed price among a Result's flights, or None"""
+        prices = [self._parse_price_value(getattr(flight, 'price', None))
+                  for flight in (getattr(result, 'flights', None) or [])]
+        prices = [price for price in prices if price is not None]
+        return min(prices) if prices else None
+
+    def _price_history_query(self, filter_data, currency):
+        """Route key, departure and return dates and passenger count of a one-way or round-trip query"""
+        flight_data = filter_data.flight_data
+        trip = 'round-trip' if len(flight_data) > 1 else 'one-way'
+        key = (flight_data[0].from_airport, flight_data[0].to_airport, trip, currency or '', filter_data.seat)
+        return_date = flight_data[1].date if len(flight_data) > 1 else None
+        return key, flight_data[0].date, return_date, len(filter_data.passengers.pb)
+
+    def _record_price(self, filter_data, currency, result):
+        """Feed the cheapest fare of a one-way or round-trip query into the route price history"""
+        key, depart_date, return_date, passengers = self._price_history_query(filter_data, currency)
+        route_price_history.record(key, self._cheapest_price(result), depart_date, return_date, passengers)
+
+    def _likely_price(self, filter_data, currency):
+        """Cached cheapest price of a query if known, else the route price history's estimate"""
+        cached = flight_query_cache.peek(self._query_cache_key(filter_data, currency, "common"))
+        price = self._cheapest_price(cached) if cached is not None else None
+        if price is not None:
+            return price
+        key, depart_date, return_date, passengers = self._price_history_query(filter_data, currency)
+        return route_price_history.estimate(key, depart_date, return_date, passengers)
+
+    def _one_way_filter(self, origin, destination, date_str, passengers, seat_class, max_stops):
         flight_data = self.FlightData(
             date=date_str,
             from_airport=origin,
@@ -1615,7 +4074,7 @@ class FlightSearchEngine:
             max_stops=max_stops
         )
 
-        filter_data = self.TFSData.from_interface(
+        return self.TFSData.from_interface(
             flight_data=[flight_data],
             trip="one-way",
             passengers=passengers,
@@ -1623,8 +4082,558 @@ class FlightSearchEngine:
             max_stops=max_stops
         )
 
-        result = self.get_flights_from_filter(filter_data, currency=api_currency)
-        return result.flights if hasattr(result, 'flights') and result.flights else []
+    def _query_cache_key(self, filter_data, currency, mode):
+        """Normalized cache key for an upstream query.
+
+        The serialized TFSData covers dates, airports, passengers, seat class,
+        trip type and max stops, so equal searches map to the same key.
+        """
+        return (filter_data.as_b64().decode('utf-8'), currency or '', mode)
+
+    def _query_flights(self, filter_data, currency, mode="common", job_ctx=None, label=None, allow_stale=False):
+        """Fetch flights for a TFSData filter, using the shared query cache.
+
+        Cache misses for a query that another job is already fetching wait
+        for that call instead of sending a duplicate upstream request. With
+        allow_stale, a recently expired entry is returned at once (its age
+        noted on job_ctx) and refreshed in the background.
+        """
+        cache_key = self._query_cache_key(filter_data, currency, mode)
+        if job_ctx is not None:
+            planned = job_ctx.planned_result(cache_key)
+            if planned is not None:
+                return planned
+
+        def fetch_and_store(ctx=job_ctx):
+            return self._fetch_and_store(filter_data, currency, mode, job_ctx=ctx, label=label)
+
+        cached = flight_query_cache.get_with_age(cache_key, allow_stale=allow_stale)
+        if cached is not None:
+            value, age, is_stale = cached
+            if is_stale:
+                if job_ctx is not None:
+                    job_ctx.note_stale(age)
+                stale_refresher.schedule(
+                    cache_key,
+                    lambda: in_flight_queries.run(cache_key, lambda: fetch_and_store(None))
+                )
+            return value
+
+        if disk_query_cache is not None:
+            disk_entry = disk_query_cache.get(json.dumps(cache_key))
+            if disk_entry is not None:
+                payload, expires_at = disk_entry
+                result = self._decode_result(payload)
+                flight_query_cache.set(cache_key, result, ttl=expires_at - time.time(),
+                                       negative=not result.flights)
+                return result
+
+        while True:
+            try:
+                return in_flight_queries.run(cache_key, fetch_and_store)
+            except JobBudgetExceeded as e:
+                # Another job led this fetch and ran out of budget; fetch it under our own
+                if e.job_ctx is job_ctx:
+                    raise
+
+    def _fetch_and_store(self, filter_data, currency, mode, job_ctx=None, label=None):
+        """Call upstream and store the result in the memory and disk caches"""
+        cache_key = self._query_cache_key(filter_data, currency, mode)
+        departure_date = min((fd.date for fd in filter_data.flight_data), default=None)
+        result = self._call_upstream(filter_data, currency, mode, job_ctx=job_ctx, label=label)
+        negative = not result.flights
+        ttl = flight_query_cache.ttl_for(departure_date, negative=negative)
+        flight_query_cache.set(cache_key, result, ttl=ttl, negative=negative)
+        if disk_query_cache is not None:
+            disk_query_cache.set(json.dumps(cache_key), self._encode_result(result), ttl=ttl)
+        return result
+
+    def _warm_query(self, filter_data, currency, refresh_within, mode="common"):
+        """Fetch a query unless it stays cached for at least refresh_within seconds.
+
+        Returns True if an upstream call was made.
+        """
+        cache_key = self._query_cache_key(filter_data, currency, mode)
+        remaining = flight_query_cache.remaining_ttl(cache_key)
+        if remaining is not None and remaining > refresh_within:
+            return False
+
+        if remaining is None and disk_query_cache is not None:
+            disk_entry = disk_query_cache.get(json.dumps(cache_key))
+            if disk_entry is not None and disk_entry[1] - time.time() > refresh_within:
+                payload, expires_at = disk_entry
+                result = self._decode_result(payload)
+                flight_query_cache.set(cache_key, result, ttl=expires_at - time.time(),
+                                       negative=not result.flights)
+                return False
+
+        in_flight_queries.run(
+            cache_key,
+            lambda: self._fetch_and_store(filter_data, currency, mode, label='cache warming')
+        )
+        return True
+
+    def _build_search_filter(self, config):
+        """TFSData filter and API currency for a regular (round-trip or one-way) search config"""
+        passengers, max_stops = self._search_passengers(config)
+
+        flight_data = [
+            self.FlightData(
+                date=config['departure_date'],
+                from_airport=config['from_airport'],
+                to_airport=config['to_airport'],
+                max_stops=max_stops
+            )
+        ]
+        trip_type = config.get('trip_type', 'round-trip')
+        if trip_type == 'round-trip':
+            flight_data.append(
+                self.FlightData(
+                    date=config['return_date'],
+                    from_airport=config['to_airport'],
+                    to_airport=config['from_airport'],
+                    max_stops=max_stops
+                )
+            )
+        else:
+            trip_type = 'one-way'
+
+        filter_data = self.TFSData.from_interface(
+            flight_data=flight_data,
+            trip=trip_type,
+            passengers=passengers,
+            seat=config['seat_class'],
+            max_stops=max_stops
+        )
+        return filter_data, config.get('currency', 'ILS')
+
+    def plan_search(self, search_type, config):
+        """Compile a search config into a QueryPlan of deduplicated upstream queries.
+
+        search_type is 'regular' (or a trip type), 'date_range' or
+        'multi_city'. Nothing is fetched; raises on an invalid config.
+        """
+        def add_one_way(plan, leg, passengers, seat_class, max_stops, currency):
+            origin, destination, date_str = leg
+            filter_data = self._one_way_filter(origin, destination, date_str, passengers, seat_class, max_stops)
+            plan.add(self._query_cache_key(filter_data, currency, "common"), filter_data, currency,
+                     f"{origin} -> {destination} {date_str}", date_str, leg=leg)
+
+        if search_type == 'multi_city':
+            passengers, seat_class, max_stops, api_currency = self._multi_city_fetch_params(config)
+            legs, combinations = self._multi_city_legs(config)
+            plan = QueryPlan('multi_city', f"{self._multi_city_mode(config)}: k-best one-way leg combinations",
+                             combinations)
+            for leg in legs:
+                add_one_way(plan, leg, passengers, seat_class, max_stops, api_currency)
+            if combination_order(config) == 'price':
+                self._order_legs_by_likely_price(plan, config)
+            return plan
+
+        if search_type == 'date_range':
+            sampling = config.get('date_sampling')
+            if sampling == 'adaptive':
+                grid = self._adaptive_grid(config)
+                plan = QueryPlan('date_range', 'adaptive: coarse grid, refined around the cheapest dates',
+                                 grid['exhaustive'])
+                for offset, days in grid['coarse']:
+                    self._plan_round_trip(
+                        plan, config,
+                        (grid['start_period'] + timedelta(days=offset)).strftime('%Y-%m-%d'),
+                        (grid['start_period'] + timedelta(days=offset + days)).strftime('%Y-%m-%d')
+                    )
+                plan.followup_queries = grid['budget'] - len(plan)
+                return plan
+
+            if sampling == 'one-way':
+                passengers, max_stops = self._search_passengers(config)
+                plan = QueryPlan('date_range', 'one-way: one-way fares composed, top round trips verified',
+                                 self._adaptive_grid(config)['exhaustive'])
+                for leg in self._one_way_range_legs(config):
+                    add_one_way(plan, leg, passengers, config['seat_class'], max_stops, config.get('currency', 'ILS'))
+                plan.followup_queries = int(config.get('verify_top') or ONE_WAY_VERIFY_TOP)
+                return plan
+
+            combinations = self._date_range_combinations(config)
+            if combination_order(config) == 'price':
+                combinations = self._order_by_likely_price(config, combinations)
+            return self._range_plan(config, combinations)
+
+        filter_data, currency = self._build_search_filter(config)
+        plan = QueryPlan('regular', 'single query', 1)
+        plan.add(self._query_cache_key(filter_data, currency, "common"), filter_data, currency,
+                 f"{config['from_airport']} -> {config['to_airport']} {config['departure_date']}",
+                 config['departure_date'])
+        return plan
+
+    def _plan_round_trip(self, plan, config, dep_date, ret_date, combination=None):
+        filter_data, currency = self._build_search_filter(
+            dict(config, departure_date=dep_date, return_date=ret_date, trip_type='round-trip')
+        )
+        plan.add(self._query_cache_key(filter_data, currency, "common"), filter_data, currency,
+                 f"{dep_date} -> {ret_date}", dep_date, combination=combination)
+
+    def _range_plan(self, config, combinations):
+        """QueryPlan of a grid range search's (departure, return, days) combinations, in their order"""
+        plan = QueryPlan('date_range', 'round trips: top-K flights', len(combinations))
+        for idx, (dep_date, ret_date, _) in enumerate(combinations):
+            self._plan_round_trip(plan, config, dep_date, ret_date, combination=idx)
+        return plan
+
+    def _order_legs_by_likely_price(self, plan, config):
+        """Reorder a multi-city range plan's legs to match its likely-cheapest-first combining loop.
+
+        Legs are fetched in the order the price-sorted combinations first
+        need them, so under a call budget or deadline the legs of the
+        likely-cheapest itineraries arrive first. Other modes keep date order.
+        """
+        if self._multi_city_mode(config) != 'multi-city-range':
+            return
+        passengers, seat_class, max_stops, api_currency = self._multi_city_fetch_params(config)
+        routes = [(config['leg1_from'], config['leg1_to']), (config['leg2_from'], config['leg2_to']),
+                  (config['leg3_from'], config['leg3_to'])]
+        combinations = self._multi_city_range_combinations(config)
+        self._order_multi_city_by_likely_price(combinations, routes, passengers, seat_class, max_stops, api_currency)
+
+        first_use = {}
+        for combo in combinations:
+            for _, mid_date in combo['mid_options']:
+                for route, leg_date in zip(routes, (combo['start'], mid_date, combo['return'])):
+                    first_use.setdefault((*route, leg_date.strftime('%Y-%m-%d')), len(first_use))
+        plan.sort(lambda query: first_use.get(query['leg'], len(first_use)))
+
+    def plan_cached_keys(self, plan):
+        """Cache keys of a plan's queries that a search could answer from the memory or disk cache"""
+        cached = {key for key in plan.queries if (flight_query_cache.remaining_ttl(key) or 0) > 0}
+        if disk_query_cache is not None:
+            missing = {json.dumps(key): key for key in plan.queries if key not in cached}
+            cached.update(missing[disk_key] for disk_key in disk_query_cache.fresh_keys(list(missing)))
+        return cached
+
+    def _fetch_planned(self, query, job_ctx=None):
+        """Fetch one planned query, memoized on job_ctx (one-way legs as flights, others as the Result)"""
+        def fetch():
+            result = self._query_flights(query['filter_data'], currency=query['currency'], mode=query['mode'],
+                                         job_ctx=job_ctx, label=query['label'])
+            self._record_price(query['filter_data'], query['currency'], result)
+            return result
+
+        def fetch_leg():
+            result = fetch()
+            return result.flights if hasattr(result, 'flights') and result.flights else []
+
+        if job_ctx is None:
+            return fetch()
+        if query['leg'] is not None:
+            return job_ctx.get_leg(query['leg'], fetch_leg)
+        return job_ctx.get_planned(query['key'], fetch)
+
+    def execute_plan(self, plan, job_ctx=None, workers=1, on_fetched=None):
+        """Fetch every query of a plan, in order or on worker threads; returns the number that failed.
+
+        Results land in the shared caches and on job_ctx, so the search's
+        combining step runs without upstream calls. on_fetched(query, error)
+        is called from this thread as each query finishes.
+        """
+        def run(query):
+            try:
+                self._fetch_planned(query, job_ctx)
+                return None
+            except Exception as e:
+                return e  # Remembered in job_ctx and reported while combining
+
+        def finish(query, error):
+            if on_fetched is not None:
+                on_fetched(query, error)
+            return error is not None
+
+        queries = list(plan)
+        if workers > 1 and len(queries) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(run, query): query for query in queries}
+                return sum(finish(futures[future], future.result()) for future in as_completed(futures))
+
+        failed = 0
+        for query in queries:
+            if job_ctx is not None and job_ctx.out_of_budget():
+                break
+            failed += finish(query, run(query))
+        return failed
+
+    def _plan_concurrency(self, config):
+        """Upstream queries a job of this config keeps in flight at once"""
+        return self._range_worker_count(config)
+
+    def _cheaper_configs(self, search_type, config):
+        """(description, config changes) variants of a config that need fewer upstream queries"""
+        variants = []
+        if search_type == 'date_range':
+            if config.get('date_sampling') != 'one-way':
+                variants.append(('Price one-way fares first and verify only the cheapest round trips',
+                                 {'date_sampling': 'one-way'}))
+            if config.get('date_sampling') != 'adaptive':
+                variants.append(('Sample dates coarse-to-fine around the cheapest fares',
+                                 {'date_sampling': 'adaptive'}))
+        if search_type == 'multi_city' and not config.get('legs'):
+            if int(config.get('leg2_flexibility', 1) or 0) > 0 \
+                    and self._multi_city_mode(config) != 'multi-city-open-jaw':
+                variants.append(('Fix the mid-trip leg date', {'leg2_flexibility': 0}))
+        if search_type in ('date_range', 'multi_city') and not config.get('legs'):
+            min_days = int(config.get('min_vacation_days', 7))
+            max_days = int(config.get('max_vacation_days', min_days))
+            if max_days > min_days:
+                narrower = min_days + (max_days - min_days) // 2
+                variants.append((f'Limit trip length to {min_days}-{narrower} days',
+                                 {'max_vacation_days': narrower}))
+        return variants
+
+    def estimate_search(self, search_type, config, tier='free'):
+        """Cost and ETA of a search, from its plan, without calling upstream.
+
+        Queries not in the cache are assumed to cost one upstream call each
+        (follow-up queries of adaptive and one-way searches included). The
+        ETA takes the slower of the rate limiter's current rate and the
+        observed median latency spread over the job's concurrency.
+        """
+        latency = upstream_policy.latency.percentile(50) or ESTIMATE_DEFAULT_LATENCY_SECONDS
+        max_upstream_calls, deadline_seconds = job_budget(tier, config)
+
+        def cost(plan, plan_config):
+            cached = len(self.plan_cached_keys(plan))
+            upstream_calls = len(plan) - cached + plan.followup_queries
+            concurrency = max(1, min(self._plan_concurrency(plan_config), upstream_calls or 1))
+            eta = max(upstream_calls / max(upstream_rate_limiter.rate, 1e-6),
+                      upstream_calls * latency / concurrency)
+            return {
+                'combinations': plan.combinations,
+                'unique_queries': len(plan),
+                'queries_requested': plan.requested,
+                'cached_queries': cached,
+                'expected_cache_hit_rate': round(cached / len(plan), 3) if len(plan) else 0.0,
+                'followup_queries': plan.followup_queries,
+                'upstream_calls': upstream_calls,
+                'eta_seconds': round(eta, 1)
+            }
+
+        estimate = cost(self.plan_search(search_type, config), config)
+        estimate['search_type'] = search_type
+        estimate['latency_seconds'] = round(latency, 2)
+        estimate['rate_per_second'] = round(upstream_rate_limiter.rate, 2)
+        estimate['budget'] = {'max_upstream_calls': max_upstream_calls, 'deadline_seconds': deadline_seconds}
+
+        over_calls = max_upstream_calls > 0 and estimate['upstream_calls'] > max_upstream_calls
+        over_deadline = deadline_seconds > 0 and estimate['eta_seconds'] > deadline_seconds
+        estimate['exceeds_budget'] = over_calls or over_deadline
+        if estimate['exceeds_budget']:
+            estimate['warning'] = 'This search would stop early at its budget and return partial results'
+        elif estimate['eta_seconds'] > ESTIMATE_WARN_SECONDS:
+            estimate['warning'] = f"This search will take about {math.ceil(estimate['eta_seconds'] / 60)} minutes"
+
+        suggestions = []
+        if estimate['exceeds_budget'] or estimate['eta_seconds'] > ESTIMATE_WARN_SECONDS:
+            for description, changes in self._cheaper_configs(search_type, config):
+                try:
+                    variant = dict(config, **changes)
+                    suggestion = cost(self.plan_search(search_type, variant), variant)
+                except Exception:
+                    continue
+                if suggestion['upstream_calls'] < estimate['upstream_calls']:
+                    suggestions.append({'description': description, 'changes': changes, **suggestion})
+            suggestions.sort(key=lambda suggestion: suggestion['upstream_calls'])
+        estimate['suggestions'] = suggestions
+        return estimate
+
+    def _encode_result(self, result):
+        """Plain-dict form of a fast_flights Result for the disk cache"""
+        return {
+            'current_price': getattr(result, 'current_price', 'typical'),
+            'flights': [dataclasses.asdict(flight) for flight in getattr(result, 'flights', None) or []]
+        }
+
+    def _decode_result(self, payload):
+        return self.Result(
+            current_price=payload.get('current_price', 'typical'),
+            flights=[self.Flight(**flight) for flight in payload.get('flights', [])]
+        )
+
+    def _call_upstream(self, filter_data, currency, mode, job_ctx=None, label=None):
+        """Call Google Flights under the upstream policy.
+
+        Each attempt is throttled, bounded by the policy timeout and checked
+        against the circuit breaker. Failures are retried with jittered
+        exponential backoff; an open breaker fails immediately. A "no
+        flights" answer comes back as an empty Result.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            if job_ctx is not None:
+                job_ctx.spend_upstream_call()
+            upstream_policy.breaker.before_call()
+            fetch_scheduler.acquire(job_ctx.tier if job_ctx is not None else 'background')
+            try:
+                result = upstream_policy.execute(
+                    self.get_flights_from_filter, filter_data, currency=currency, mode=mode,
+                    hedge_budget=job_ctx.try_spend_upstream_call if job_ctx is not None else None
+                )
+            except UpstreamPoolBusy:
+                # Local congestion, not an upstream failure: keep the breaker and limiter out of it,
+                # but hand back a half-open probe so the breaker does not wait on it forever
+                upstream_policy.breaker.release_probe()
+                raise
+            except Exception as e:
+                if is_no_flights_error(e):
+                    # An empty answer means the upstream is healthy; cache it as a result
+                    upstream_rate_limiter.record_success()
+                    upstream_policy.breaker.record_success()
+                    return self.Result(current_price='unknown', flights=[])
+
+                upstream_rate_limiter.record_failure(e)
+                upstream_policy.breaker.record_failure()
+                if attempt > upstream_policy.max_retries:
+                    raise
+
+                if job_ctx is not None:
+                    job_ctx.note_retry(label)
+                time.sleep(upstream_policy.backoff_delay(attempt))
+                continue
+
+            upstream_rate_limiter.record_success()
+            upstream_policy.breaker.record_success()
+            return result
+
+    def _parse_duration_minutes(self, duration):
+        """Convert a duration such as '12 hr 35 min' to minutes (None if unknown)."""
+        if isinstance(duration, (int, float)):
+            return float(duration)
+        import re
+        match = re.match(r'\s*(?:(\d+)\s*hr?s?)?\s*(?:(\d+)\s*min)?', str(duration or ''))
+        if not match or not any(match.groups()):
+            return None
+        return float(int(match.group(1) or 0) * 60 + int(match.group(2) or 0))
+
+    def _rank_leg_flights(self, flights, beam_width):
+        """Price-sorted candidates of one leg, cut to beam_width.
+
+        Returns a dict of parallel lists (prices, minutes, stops, flights),
+        plus NumPy arrays of the numeric columns when NumPy is available.
+        Flights without a price are dropped; unknown durations and stops count as 0.
+        """
+        priced = []
+        for position, flight in enumerate(flights):
+            price = self._parse_price_value(getattr(flight, 'price', None))
+            if price is None:
+                continue
+            minutes = self._parse_duration_minutes(getattr(flight, 'duration', None)) or 0.0
+            stops = getattr(flight, 'stops', 0)
+            stops = stops if isinstance(stops, int) else 0
+            priced.append((price, position, minutes, stops, flight))
+        priced.sort(key=lambda entry: entry[:2])
+        priced = priced[:beam_width]
+
+        leg = {
+            'prices': [entry[0] for entry in priced],
+            'minutes': [entry[2] for entry in priced],
+            'stops': [entry[3] for entry in priced],
+            'flights': [entry[4] for entry in priced]
+        }
+        if np is not None:
+            leg['price_array'] = np.array(leg['prices'], dtype=float)
+            leg['minute_array'] = np.array(leg['minutes'], dtype=float)
+            leg['stop_array'] = np.array(leg['stops'], dtype=int)
+        return leg
+
+    def _add_best_combinations(self, best_combinations, legs, build, beam_width, job_ctx=None,
+                               max_total_minutes=0, max_total_stops=-1):
+        """Add the cheapest combinations of one flight per leg to best_combinations.
+
+        Each leg's flights are priced and sorted once per job and cut to
+        beam_width. With NumPy, all combinations are scored at once by
+        broadcasting the per-leg arrays; otherwise (or when there are more
+        than VECTORIZED_COMBINE_MAX_CELLS) they are enumerated cheapest first
+        from a priority queue of per-leg index tuples. Either way only
+        combinations that can enter the top K get built.
+        build(prices, flights) returns the combination dict.
+        """
+        def rank(flights):
+            return self._rank_leg_flights(flights, beam_width)
+
+        ranked = []
+        for flights in legs:
+            leg = job_ctx.get_ranked_leg(flights, rank) if job_ctx is not None else rank(flights)
+            if not leg['prices']:
+                return
+            ranked.append(leg)
+
+        def add(indices, total_price):
+            best_combinations.push(
+                build([leg['prices'][index] for leg, index in zip(ranked, indices)],
+                      [leg['flights'][index] for leg, index in zip(ranked, indices)]),
+                total_price
+            )
+
+        candidates = 1
+        for leg in ranked:
+            candidates *= len(leg['prices'])
+        best_combinations.note_seen(candidates)
+
+        if not best_combinations.admits(sum(leg['prices'][0] for leg in ranked)):
+            return  # Even the cheapest combination would not be kept
+
+        if np is not None and candidates <= VECTORIZED_COMBINE_MAX_CELLS:
+            shape = tuple(len(leg['prices']) for leg in ranked)
+            totals = functools.reduce(np.add, np.ix_(*[leg['price_array'] for leg in ranked])).ravel()
+            keep = totals < best_combinations.threshold()
+            if max_total_minutes > 0:
+                minutes = functools.reduce(np.add, np.ix_(*[leg['minute_array'] for leg in ranked]))
+                keep &= minutes.ravel() <= max_total_minutes
+            if max_total_stops >= 0:
+                stops = functools.reduce(np.add, np.ix_(*[leg['stop_array'] for leg in ranked]))
+                keep &= stops.ravel() <= max_total_stops
+
+            cells = np.flatnonzero(keep)
+            # Cheapest first, ties in index order like the queue below, so the
+            # top k are the same cells the queue would pick
+            cells = cells[np.lexsort((cells, totals[cells]))]
+            if best_combinations.k > 0:
+                cells = cells[:best_combinations.k]
+
+            for cell in cells:
+                total_price = float(totals[cell])
+                if not best_combinations.admits(total_price):
+                    break
+                add(np.unravel_index(cell, shape), total_price)
+            return
+
+        def total(indices):
+            return sum(leg['prices'][index] for leg, index in zip(ranked, indices))
+
+        def within_limits(indices):
+            if max_total_minutes > 0 and \
+                    sum(leg['minutes'][index] for leg, index in zip(ranked, indices)) > max_total_minutes:
+                return False
+            if max_total_stops >= 0 and \
+                    sum(leg['stops'][index] for leg, index in zip(ranked, indices)) > max_total_stops:
+                return False
+            return True
+
+        start = (0,) * len(ranked)
+        frontier = [(total(start), start)]
+        visited = {start}
+        while frontier:
+            total_price, indices = heapq.heappop(frontier)
+            if not best_combinations.admits(total_price):
+                break
+
+            if within_limits(indices):
+                add(indices, total_price)
+
+            for leg, index in enumerate(indices):
+                if index + 1 < len(ranked[leg]['prices']):
+                    successor = indices[:leg] + (index + 1,) + indices[leg + 1:]
+                    if successor not in visited:
+                        visited.add(successor)
+                        heapq.heappush(frontier, (total(successor), successor))
 
     def _build_leg_details(self, origin, destination, date_str, flight, price):
         return {
@@ -1639,10 +4648,293 @@ class FlightSearchEngine:
             'arrival': getattr(flight, 'arrival', 'N/A')
             }
 
+class AsyncFlightSearchEngine(FlightSearchEngine):
+    """Search engine backend that runs jobs as coroutines on one event loop.
+
+    fast_flights only ships a blocking HTTP client, so each upstream query is
+    awaited through a bounded executor. Jobs are admitted by an AsyncJobQueue
+    on the same loop, and fan-out, progress and combining run there too, so
+    a job waiting on the network holds no OS thread; only its in-flight
+    queries do.
+    """
+
+    def __init__(self, max_in_flight=200, job_max_in_flight=4):
+        super().__init__()
+        self.max_in_flight = max_in_flight
+        self.job_max_in_flight = job_max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='flights-io')
+        # Single worker keeps progress writes for a job in order
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='flights-db')
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._loop_thread.start()
+        print(f"Async search engine running (max {max_in_flight} in-flight queries, {job_max_in_flight} per job)")
+
+    def _run(self, coro):
+        """Run a coroutine on the engine loop and block until it finishes"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _call_blocking(self, fn, *args, **kwargs):
+        return await self._loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def _call_db(self, fn, *args, **kwargs):
+        return await self._loop.run_in_executor(self._db_executor, functools.partial(fn, *args, **kwargs))
+
+    def search(self, config, job_id=None):
+        return self._run(self.search_async(config, job_id=job_id))
+
+    def search_date_range(self, config, job_id=None):
+        return self._run(self.search_date_range_async(config, job_id=job_id))
+
+    def search_multi_city(self, config, job_id=None, job_ctx=None):
+        return self._run(self.search_multi_city_async(config, job_id=job_id, job_ctx=job_ctx))
+
+    def start_job(self, method_name, config, job_id, on_complete, on_error, tier='free'):
+        """Queue a search job to run as a coroutine on the event loop (raises JobQueueFull)"""
+        def background_search():
+            fetch_scheduler.assign_job(job_id, tier)
+            coro = getattr(self, method_name + '_async')(config, job_id=job_id)
+            return self._run_job(coro, job_id, on_complete, on_error)
+
+        job_executor.submit(job_id, background_search)
+
+    async def _run_job(self, coro, job_id, on_complete, on_error):
+        try:
+            result = await coro
+            await self._call_db(on_complete, result)
+        except Exception as e:
+            await self._call_db(on_error, e)
+        finally:
+            fetch_scheduler.release_job(job_id)
+
+    def _plan_concurrency(self, config):
+        return self.job_max_in_flight
+
+    async def execute_plan_async(self, plan, job_ctx=None, on_fetched=None):
+        """Fetch the queries of a plan concurrently on the loop, in plan order.
+
+        At most job_max_in_flight queries of the job are submitted at once, so
+        one large job cannot flood the shared executor ahead of other jobs.
+        on_fetched(query, error) runs on the single DB worker as each query
+        finishes, so callbacks never overlap and their progress writes stay in order.
+        """
+        in_flight = asyncio.Semaphore(self.job_max_in_flight)
+
+        async def run(query):
+            async with in_flight:
+                try:
+                    await self._call_blocking(self._fetch_planned, query, job_ctx)
+                    return query, None
+                except Exception as e:
+                    return query, e  # Remembered in job_ctx and reported while combining
+
+        # Tasks start in creation order, so they queue on the semaphore in plan order
+        tasks = [asyncio.ensure_future(run(query)) for query in plan]
+        for next_done in asyncio.as_completed(tasks):
+            query, error = await next_done
+            if on_fetched is not None:
+                await self._call_db(on_fetched, query, error)
+
+    async def search_async(self, config, job_id=None):
+        # A single query - nothing to fan out
+        return await self._call_blocking(FlightSearchEngine.search, self, config, job_id=job_id)
+
+    async def search_date_range_async(self, config, job_id=None):
+        if config.get('date_sampling') in ('adaptive', 'one-way'):
+            # Each phase depends on the previous one, so run it as a blocking job
+            return await self._call_blocking(FlightSearchEngine.search_date_range, self, config, job_id=job_id)
+
+        try:
+            passengers, max_stops, all_combinations = self._prepare_date_range(config)
+            total_combinations = len(all_combinations)
+            job_ctx = SearchJobContext(job_id, config)
+            best_flights = self._range_results(config)
+
+            on_fetched, counts = self._range_plan_collector(
+                config, all_combinations, job_id, job_ctx, best_flights
+            )
+            await self.execute_plan_async(self._range_plan(config, all_combinations), job_ctx, on_fetched=on_fetched)
+            job_ctx.note_coverage(counts['searched'], total_combinations)
+            return await self._call_db(self._complete_date_range, best_flights, total_combinations, job_id, job_ctx)
+
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'flights': [],
+                'total_found': 0,
+                'search_type': 'date_range'
+            }
+
+    async def search_multi_city_async(self, config, job_id=None, job_ctx=None):
+        job_ctx = job_ctx or SearchJobContext(job_id, config)
+
+        try:
+            plan = self.plan_search('multi_city', config)
+        except Exception:
+            # Invalid config - let the regular search report the error
+            plan = None
+
+        if plan:
+            await self._call_db(
+                send_progress_update,
+                current=0,
+                total=0,
+                current_dates=f"Fetching {len(plan)} flight legs...",
+                status="preparing",
+                flights_found=0,
+                job_id=job_id
+            )
+            await self.execute_plan_async(plan, job_ctx, on_fetched=self._leg_progress(plan, job_id))
+
+        # Every leg is now in job_ctx, so combining makes no upstream calls
+        return await self._call_blocking(FlightSearchEngine.search_multi_city, self, config,
+                                         job_id=job_id, job_ctx=job_ctx)
+
+class CacheWarmer:
+    """Background thread that keeps the most-searched queries cached.
+
+    Each cycle ranks recent search_history entries, expands them into the
+    individual upstream queries they need and fetches those that are missing
+    or would expire before the next cycle. A cycle spends at most budget
+    upstream calls and stops as soon as a search job is running.
+    """
+
+    def __init__(self, engine, interval_seconds=300, budget=30, top_searches=20, lookback_days=7):
+        self.engine = engine
+        self.interval_seconds = interval_seconds
+        self.budget = budget
+        self.top_searches = top_searches
+        self.lookback_days = lookback_days
+        self._thread = None
+        self.cycles = 0
+        self.busy_skips = 0
+        self.upstream_calls = 0
+        self.already_fresh = 0
+        self.errors = 0
+        self.last_cycle_at = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='cache-warmer', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                self.run_cycle()
+            except Exception as e:
+                print(f"Cache warming error: {e}")
+
+    def is_quiet(self):
+        """True when no search job has been active in the last few minutes"""
+        cutoff = (datetime.now() - timedelta(minutes=10)).isoformat()
+        conn = sqlite3.connect('jobs.db', timeout=10)
+        try:
+            c = conn.cursor()
+            c.execute('''SELECT COUNT(*) FROM jobs
+                         WHERE status NOT IN ('completed', 'error') AND updated_at > ?''', (cutoff,))
+            return c.fetchone()[0] == 0
+        finally:
+            conn.close()
+
+    def popular_queries(self):
+        """(filter_data, currency, mode) for the queries of the top recent searches, most searched first"""
+        conn = sqlite3.connect('jobs.db', timeout=10)
+        try:
+            c = conn.cursor()
+            c.execute('''SELECT search_type, search_params, COUNT(*) AS searches
+                         FROM search_history
+                         WHERE created_at > datetime('now', ?)
+                           AND search_type IN ('round-trip', 'one-way', 'date_range', 'multi_city')
+                         GROUP BY search_type, search_params
+                         ORDER BY searches DESC
+                         LIMIT ?''', (f'-{self.lookback_days} days', self.top_searches))
+            rows = c.fetchall()
+        finally:
+            conn.close()
+
+        today = datetime.now().strftime('%Y-%m-%d')
+        weights = {}
+        queries = {}
+        for search_type, search_params, searches in rows:
+            try:
+                plan = self.engine.plan_search(search_type, json.loads(search_params))
+                for query in plan:
+                    if query['departure_date'] < today:
+                        continue
+                    queries.setdefault(query['key'], (query['filter_data'], query['currency'], query['mode']))
+                    weights[query['key']] = weights.get(query['key'], 0) + searches
+            except Exception as e:
+                print(f"Skipping search history entry for cache warming: {e}")
+
+        ranked = sorted(queries, key=lambda cache_key: weights[cache_key], reverse=True)
+        return [queries[cache_key] for cache_key in ranked]
+
+    def run_cycle(self):
+        """Warm popular queries until the budget is spent or searches start"""
+        self.cycles += 1
+        self.last_cycle_at = datetime.now().isoformat()
+        if not self.is_quiet():
+            self.busy_skips += 1
+            return 0
+
+        calls = 0
+        for filter_data, currency, mode in self.popular_queries():
+            if calls >= self.budget:
+                break
+            if calls and not self.is_quiet():
+                self.busy_skips += 1
+                break
+            try:
+                if self.engine._warm_query(filter_data, currency, refresh_within=self.interval_seconds, mode=mode):
+                    calls += 1
+                else:
+                    self.already_fresh += 1
+            except CircuitBreakerOpen:
+                break
+            except Exception as e:
+                calls += 1
+                self.errors += 1
+                print(f"Cache warming query failed: {e}")
+
+        self.upstream_calls += calls
+        if calls:
+            print(f"Cache warming: {calls} upstream calls")
+        return calls
+
+    def stats(self):
+        return {
+            'enabled': self._thread is not None,
+            'interval_seconds': self.interval_seconds,
+            'budget': self.budget,
+            'cycles': self.cycles,
+            'busy_skips': self.busy_skips,
+            'upstream_calls': self.upstream_calls,
+            'already_fresh': self.already_fresh,
+            'errors': self.errors,
+            'last_cycle_at': self.last_cycle_at
+        }
+
 # Initialize search engine
 print("Initializing search engine...")
 try:
-    search_engine = FlightSearchEngine()
+    if SEARCH_ENGINE_BACKEND == 'asyncio':
+        search_engine = AsyncFlightSearchEngine(max_in_flight=ASYNC_MAX_IN_FLIGHT,
+                                            job_max_in_flight=ASYNC_JOB_MAX_IN_FLIGHT)
+        job_executor = AsyncJobQueue(search_engine._loop, ASYNC_JOB_WORKERS, JOB_QUEUE_SIZE)
+    else:
+        search_engine = FlightSearchEngine()
+        job_executor = JobExecutor(JOB_WORKERS, JOB_QUEUE_SIZE)
+    cache_warmer = CacheWarmer(
+        search_engine,
+        interval_seconds=CACHE_WARM_INTERVAL_SECONDS,
+        budget=CACHE_WARM_BUDGET,
+        top_searches=CACHE_WARM_TOP_SEARCHES,
+        lookback_days=CACHE_WARM_LOOKBACK_DAYS
+    )
+    if CACHE_WARMING:
+        cache_warmer.start()
     print("Search engine initialized successfully")
 except Exception as e:
     print(f"Failed to initialize search engine: {e}")
@@ -1676,6 +4968,31 @@ def send_progress_update(current, total, current_dates, status, flights_found=0,
         if len(progress_updates) > 100:
             progress_updates = progress_updates[-100:]
 
+def reject_queued_search(job_id, error, user_id, refund_quota):
+    """503 response for a search the job queue could not take, giving back its quota"""
+    if refund_quota:
+        conn = sqlite3.connect('jobs.db')
+        c = conn.cursor()
+        c.execute('UPDATE user_quota SET searches_used = MAX(0, searches_used - 1) WHERE user_id = ?', (user_id,))
+        conn.commit()
+        conn.close()
+    update_job_progress(job_id, 0, 0, 'Search queue is full', 'error', 0)
+
+    response = jsonify({
+        'error': 'Search queue is full',
+        'message': f'Too many searches are running right now. Please try again in {error.retry_after} seconds.',
+        'retry_after': error.retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def fail_background_search(job_id, error):
+    """Record a background search failure for the job"""
+    print(f"Background search error: {error}")
+    update_job_progress(job_id, 0, 0, f'Error: {str(error)}', 'error', 0)
+    save_job_result(job_id, {'error': str(error)})
+
 @app.route('/')
 def index():
     print("DEBUG: index() called")
@@ -1980,6 +5297,26 @@ def admin_block_user(current_user_id, current_user_email, is_admin=0):
     print(f"Admin {current_user_email} {action} user {user_id}")
     return jsonify({'success': True})
 
+@app.route('/admin/cache_stats')
+@require_auth
+def admin_cache_stats(current_user_id, current_user_email, is_admin=0):
+    """Upstream query cache statistics - admin only"""
+    if not is_admin:
+        return jsonify({'error': 'Forbidden'}), 403
+
+    return jsonify({
+        'query_cache': flight_query_cache.stats(),
+        'disk_cache': disk_query_cache.stats() if disk_query_cache is not None else None,
+        'in_flight': in_flight_queries.stats(),
+        'stale_refresh': stale_refresher.stats(),
+        'rate_limiter': upstream_rate_limiter.stats(),
+        'fetch_scheduler': fetch_scheduler.stats(),
+        'upstream_policy': upstream_policy.stats(),
+        'cache_warmer': cache_warmer.stats(),
+        'job_executor': job_executor.stats(),
+        'price_history': route_price_history.stats()
+    })
+
 @app.route('/api/user_info')
 def user_info():
     """Get current user info (for frontend)"""
@@ -2052,6 +5389,10 @@ def progress_status():
     progress = get_job_progress(job_id)
     
     if progress:
+        queued = job_executor.position(job_id)
+        if queued is not None and queued[0] > 0:
+            progress['queue_position'], progress['estimated_wait_seconds'] = queued
+            progress['current_dates'] = f'Waiting in queue (position {queued[0]})...'
         return jsonify(progress)
     else:
         return jsonify({
@@ -2084,6 +5425,85 @@ def get_search_results():
     else:
         return jsonify({'status': 'no_results'})
 
+def regular_search_config(form):
+    """Search config for a regular (single-date) search from the submitted form"""
+    return {
+        'from_airport': form.get('from_airport', 'TLV').upper(),
+        'to_airport': form.get('to_airport', 'BKK').upper(),
+        'departure_date': form.get('departure_date'),
+        'return_date': form.get('return_date'),
+        'trip_type': form.get('trip_type', 'round-trip'),
+        'adults': int(form.get('adults', 1)),
+        'children': int(form.get('children', 0)),
+        'infants_seat': int(form.get('infants_seat', 0)),
+        'infants_lap': int(form.get('infants_lap', 0)),
+        'seat_class': form.get('seat_class', 'economy'),
+        'max_stops': int(form.get('max_stops', -1)),
+        'currency': form.get('currency', 'ILS')
+    }
+
+def range_search_config(form):
+    """Search config for a date range search from the submitted form"""
+    return {
+        'from_airport': form.get('from_airport', 'TLV').upper(),
+        'to_airport': form.get('to_airport', 'BKK').upper(),
+        'start_period': form.get('start_period'),
+        'end_period': form.get('end_period'),
+        'min_vacation_days': int(form.get('min_vacation_days', 7)),
+        'max_vacation_days': int(form.get('max_vacation_days', 21)),
+        'concurrent_workers': int(form.get('concurrent_workers', 0) or 0),
+        'max_upstream_calls': int(form.get('max_upstream_calls', 0) or 0),
+        'deadline_seconds': int(form.get('deadline_seconds', 0) or 0),
+        'date_sampling': form.get('date_sampling', 'grid'),
+        'verify_top': int(form.get('verify_top', 0) or 0),
+        'combination_order': form.get('combination_order', COMBINATION_ORDER),
+        'top_k': int(form.get('top_k', 0) or 0),
+        'adults': int(form.get('adults', 1)),
+        'children': int(form.get('children', 0)),
+        'infants_seat': int(form.get('infants_seat', 0)),
+        'infants_lap': int(form.get('infants_lap', 0)),
+        'seat_class': form.get('seat_class', 'economy'),
+        'max_stops': int(form.get('max_stops', -1)),
+        'currency': form.get('currency', 'ILS')
+    }
+
+def multi_city_search_config(form):
+    """Search config for a multi-city search from the submitted form"""
+    return {
+        'leg1_from': form.get('leg1_from', 'TLV').upper(),
+        'leg1_to': form.get('leg1_to', 'HKT').upper(),
+        'leg2_from': form.get('leg2_from', 'HKT').upper(),
+        'leg2_to': form.get('leg2_to', 'BKK').upper(),
+        'leg2_date': form.get('leg2_date'),
+        'leg2_target_day': int(form.get('leg2_target_day', 8) or 8),
+        'leg2_flexibility': int(form.get('leg2_flexibility', 1) or 1),
+        'leg3_from': form.get('leg3_from', 'BKK').upper(),
+        'leg3_to': form.get('leg3_to', 'TLV').upper(),
+        'leg3_date': form.get('leg3_date'),
+        'leg1_date': form.get('leg1_date'),
+        'adults': int(form.get('adults', 1) or 1),
+        'children': int(form.get('children', 0) or 0),
+        'infants_seat': int(form.get('infants_seat', 0) or 0),
+        'infants_lap': int(form.get('infants_lap', 0) or 0),
+        'seat_class': form.get('seat_class', 'economy'),
+        'max_stops': int(form.get('max_stops', -1) or -1),
+        'currency': form.get('currency', 'ILS'),
+        'start_period': form.get('start_period'),
+        'end_period': form.get('end_period'),
+        'min_vacation_days': int(form.get('min_vacation_days', 7) or 7),
+        'max_vacation_days': int(form.get('max_vacation_days', 21) or 21),
+        'multi_city_mode': form.get('multi_city_mode', 'multi-city-range'),
+        'concurrent_workers': int(form.get('concurrent_workers', 0) or 0),
+        'max_upstream_calls': int(form.get('max_upstream_calls', 0) or 0),
+        'deadline_seconds': int(form.get('deadline_seconds', 0) or 0),
+        'combination_order': form.get('combination_order', COMBINATION_ORDER),
+        'top_k': int(form.get('top_k', 0) or 0),
+        'beam_width': int(form.get('beam_width', 0) or 0),
+        'max_total_duration_hours': float(form.get('max_total_duration_hours', 0) or 0),
+        'max_total_stops': int(form.get('max_total_stops', -1) or -1),
+        'legs': form.get('legs')
+    }
+
 @app.route('/search', methods=['POST'])
 @require_auth
 def search_flights(current_user_id, current_user_email, is_admin=0):
@@ -2131,52 +5551,36 @@ def search_flights(current_user_id, current_user_email, is_admin=0):
         # Generate unique job ID
         job_id = str(uuid.uuid4())
         
-        config = {
-            'from_airport': request.form.get('from_airport', 'TLV').upper(),
-            'to_airport': request.form.get('to_airport', 'BKK').upper(),
-            'departure_date': request.form.get('departure_date'),
-            'return_date': request.form.get('return_date'),
-            'trip_type': request.form.get('trip_type', 'round-trip'),
-            'adults': int(request.form.get('adults', 1)),
-            'children': int(request.form.get('children', 0)),
-            'infants_seat': int(request.form.get('infants_seat', 0)),
-            'infants_lap': int(request.form.get('infants_lap', 0)),
-            'seat_class': request.form.get('seat_class', 'economy'),
-            'max_stops': int(request.form.get('max_stops', -1)),
-            'currency': request.form.get('currency', 'ILS')
-        }
+        config = regular_search_config(request.form)
 
         # Initialize job in database
         update_job_progress(job_id, 0, 0, 'Initializing...', 'preparing', 0)
 
-        # Start search in background thread
-        import threading
-        def background_search():
-            try:
-                result = search_engine.search(config, job_id=job_id)
-                # Store result in database
-                save_job_result(job_id, {'result': result, 'config': config})
-                
-                # Save search history
-                conn = sqlite3.connect('jobs.db')
-                c = conn.cursor()
-                c.execute('''INSERT INTO search_history 
-                             (user_id, search_type, search_params, results_count) 
-                             VALUES (?, ?, ?, ?)''',
-                          (current_user_id, 
-                           config.get('trip_type', 'round-trip'),
-                           json.dumps(config),
-                           len(result.get('flights', []))))
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                print(f"Background search error: {e}")
-                update_job_progress(job_id, 0, 0, f'Error: {str(e)}', 'error', 0)
-                save_job_result(job_id, {'error': str(e)})
+        # Start search in the background
+        def save_search(result):
+            # Store result in database
+            save_job_result(job_id, {'result': result, 'config': config})
+            
+            # Save search history
+            conn = sqlite3.connect('jobs.db')
+            c = conn.cursor()
+            c.execute('''INSERT INTO search_history 
+                         (user_id, search_type, search_params, results_count) 
+                         VALUES (?, ?, ?, ?)''',
+                      (current_user_id, 
+                       config.get('trip_type', 'round-trip'),
+                       json.dumps(config),
+                       len(result.get('flights', []))))
+            conn.commit()
+            conn.close()
 
-        thread = threading.Thread(target=background_search)
-        thread.daemon = True
-        thread.start()
+        try:
+            search_engine.start_job('search', config, job_id,
+                                    on_complete=save_search,
+                                    on_error=lambda e: fail_background_search(job_id, e),
+                                    tier='admin' if is_admin else tier)
+        except JobQueueFull as e:
+            return reject_queued_search(job_id, e, current_user_id, refund_quota=not skip_quota)
 
         # Return job_id to client
         return jsonify({
@@ -2235,49 +5639,33 @@ def search_flights_range(current_user_id, current_user_email, is_admin=0):
         # Generate unique job ID
         job_id = str(uuid.uuid4())
         
-        config = {
-            'from_airport': request.form.get('from_airport', 'TLV').upper(),
-            'to_airport': request.form.get('to_airport', 'BKK').upper(),
-            'start_period': request.form.get('start_period'),
-            'end_period': request.form.get('end_period'),
-            'min_vacation_days': int(request.form.get('min_vacation_days', 7)),
-            'max_vacation_days': int(request.form.get('max_vacation_days', 21)),
-            'adults': int(request.form.get('adults', 1)),
-            'children': int(request.form.get('children', 0)),
-            'infants_seat': int(request.form.get('infants_seat', 0)),
-            'infants_lap': int(request.form.get('infants_lap', 0)),
-            'seat_class': request.form.get('seat_class', 'economy'),
-            'max_stops': int(request.form.get('max_stops', -1)),
-            'currency': request.form.get('currency', 'ILS')
-        }
+        config = range_search_config(request.form)
         
         # Initialize job in database
         update_job_progress(job_id, 0, 0, 'Initializing...', 'preparing', 0)
         
-        # Start search in background thread
-        def background_search():
-            try:
-                result = search_engine.search_date_range(config, job_id=job_id)
-                save_job_result(job_id, {'result': result, 'config': config})
-                
-                # Save search history
-                conn = sqlite3.connect('jobs.db')
-                c = conn.cursor()
-                c.execute('''INSERT INTO search_history 
-                             (user_id, search_type, search_params, results_count) 
-                             VALUES (?, ?, ?, ?)''',
-                          (current_user_id, 'date_range', json.dumps(config),
-                           len(result.get('flights', []))))
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                print(f"Background search error: {e}")
-                update_job_progress(job_id, 0, 0, f'Error: {str(e)}', 'error', 0)
-                save_job_result(job_id, {'error': str(e)})
+        # Start search in the background
+        def save_search(result):
+            save_job_result(job_id, {'result': result, 'config': config})
+            
+            # Save search history
+            conn = sqlite3.connect('jobs.db')
+            c = conn.cursor()
+            c.execute('''INSERT INTO search_history 
+                         (user_id, search_type, search_params, results_count) 
+                         VALUES (?, ?, ?, ?)''',
+                      (current_user_id, 'date_range', json.dumps(config),
+                       len(result.get('flights', []))))
+            conn.commit()
+            conn.close()
         
-        thread = threading.Thread(target=background_search)
-        thread.daemon = True
-        thread.start()
+        try:
+            search_engine.start_job('search_date_range', config, job_id,
+                                    on_complete=save_search,
+                                    on_error=lambda e: fail_background_search(job_id, e),
+                                    tier='admin' if is_admin else tier)
+        except JobQueueFull as e:
+            return reject_queued_search(job_id, e, current_user_id, refund_quota=not skip_quota)
         
         return jsonify({
             'status': 'search_started',
@@ -2335,59 +5723,33 @@ def search_multi_city(current_user_id, current_user_email, is_admin=0):
         # Generate unique job ID
         job_id = str(uuid.uuid4())
 
-        config = {
-            'leg1_from': request.form.get('leg1_from', 'TLV').upper(),
-            'leg1_to': request.form.get('leg1_to', 'HKT').upper(),
-            'leg2_from': request.form.get('leg2_from', 'HKT').upper(),
-            'leg2_to': request.form.get('leg2_to', 'BKK').upper(),
-            'leg2_date': request.form.get('leg2_date'),
-            'leg2_target_day': int(request.form.get('leg2_target_day', 8) or 8),
-            'leg2_flexibility': int(request.form.get('leg2_flexibility', 1) or 1),
-            'leg3_from': request.form.get('leg3_from', 'BKK').upper(),
-            'leg3_to': request.form.get('leg3_to', 'TLV').upper(),
-            'leg3_date': request.form.get('leg3_date'),
-            'leg1_date': request.form.get('leg1_date'),
-            'adults': int(request.form.get('adults', 1) or 1),
-            'children': int(request.form.get('children', 0) or 0),
-            'infants_seat': int(request.form.get('infants_seat', 0) or 0),
-            'infants_lap': int(request.form.get('infants_lap', 0) or 0),
-            'seat_class': request.form.get('seat_class', 'economy'),
-            'max_stops': int(request.form.get('max_stops', -1) or -1),
-            'currency': request.form.get('currency', 'ILS'),
-            'start_period': request.form.get('start_period'),
-            'end_period': request.form.get('end_period'),
-            'min_vacation_days': int(request.form.get('min_vacation_days', 7) or 7),
-            'max_vacation_days': int(request.form.get('max_vacation_days', 21) or 21),
-            'multi_city_mode': request.form.get('multi_city_mode', 'multi-city-range')
-        }
+        config = multi_city_search_config(request.form)
         
         # Initialize job in database
         update_job_progress(job_id, 0, 0, 'Initializing...', 'preparing', 0)
         
-        # Start search in background thread
-        def background_search():
-            try:
-                result = search_engine.search_multi_city(config, job_id=job_id)
-                save_job_result(job_id, {'result': result, 'config': config})
-                
-                # Save search history
-                conn = sqlite3.connect('jobs.db')
-                c = conn.cursor()
-                c.execute('''INSERT INTO search_history 
-                             (user_id, search_type, search_params, results_count) 
-                             VALUES (?, ?, ?, ?)''',
-                          (current_user_id, 'multi_city', json.dumps(config),
-                           len(result.get('flights', []))))
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                print(f"Background search error: {e}")
-                update_job_progress(job_id, 0, 0, f'Error: {str(e)}', 'error', 0)
-                save_job_result(job_id, {'error': str(e)})
+        # Start search in the background
+        def save_search(result):
+            save_job_result(job_id, {'result': result, 'config': config})
+            
+            # Save search history
+            conn = sqlite3.connect('jobs.db')
+            c = conn.cursor()
+            c.execute('''INSERT INTO search_history 
+                         (user_id, search_type, search_params, results_count) 
+                         VALUES (?, ?, ?, ?)''',
+                      (current_user_id, 'multi_city', json.dumps(config),
+                       len(result.get('flights', []))))
+            conn.commit()
+            conn.close()
         
-        thread = threading.Thread(target=background_search)
-        thread.daemon = True
-        thread.start()
+        try:
+            search_engine.start_job('search_multi_city', config, job_id,
+                                    on_complete=save_search,
+                                    on_error=lambda e: fail_background_search(job_id, e),
+                                    tier='admin' if is_admin else tier)
+        except JobQueueFull as e:
+            return reject_queued_search(job_id, e, current_user_id, refund_quota=not skip_quota)
         
         return jsonify({
             'status': 'search_started',
@@ -2404,6 +5766,61 @@ def search_multi_city(current_user_id, current_user_email, is_admin=0):
             'search_type': 'multi_city'
         })
 
+def dry_run_search_config(form):
+    """(search_type, config) for /plan and /estimate, which take the search routes' form fields"""
+    search_type = form.get('search_type', 'regular')
+    if search_type == 'date_range':
+        return search_type, range_search_config(form)
+    if search_type == 'multi_city':
+        return search_type, multi_city_search_config(form)
+    return 'regular', regular_search_config(form)
+
+@app.route('/plan', methods=['POST'])
+@require_auth
+def plan_search_request(current_user_id, current_user_email, is_admin=0):
+    """Dry run: the deduplicated upstream queries a search would make, without running it"""
+    search_type = request.form.get('search_type', 'regular')
+    try:
+        search_type, config = dry_run_search_config(request.form)
+        plan = search_engine.plan_search(search_type, config)
+        return jsonify({
+            'success': True,
+            **plan.to_dict(search_engine.plan_cached_keys(plan))
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'search_type': search_type
+        }), 400
+
+@app.route('/estimate', methods=['POST'])
+@require_auth
+def estimate_search_request(current_user_id, current_user_email, is_admin=0):
+    """Dry run: combinations, upstream queries, cache hit rate and ETA of a search, plus cheaper options"""
+    search_type = request.form.get('search_type', 'regular')
+    try:
+        conn = sqlite3.connect('jobs.db')
+        c = conn.cursor()
+        c.execute('SELECT tier FROM user_quota WHERE user_id = ?', (current_user_id,))
+        row = c.fetchone()
+        conn.close()
+        tier = 'admin' if is_admin else ((row[0] if row else None) or 'free')
+
+        search_type, config = dry_run_search_config(request.form)
+        return jsonify({
+            'success': True,
+            **search_engine.estimate_search(search_type, config, tier=tier)
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'search_type': search_type
+        }), 400
+
 def open_browser(port):
     time.sleep(1.5)
     webbrowser.open(f'http://127.0.0.1:{port}')